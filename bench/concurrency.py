@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Stress test of concurrent lookups, as served with multithreaded=1, on a synthetic index.
+
+For 1, 2, 4 and 8 parallel clients it reports
+- the throughput of cached lookups (readdir + getattr of facet directories),
+- the throughput of cold lookups, each client resolving distinct uncached directories,
+- the worst latency of cached lookups while another client rebuilds the root listing.
+
+Lookups are CPU-bound python and hold the GIL, so throughput does not scale with clients;
+what multithreading buys is that a slow lookup no longer blocks the others.
+
+usage: python bench/concurrency.py [entries]    (default: 100000)
+"""
+
+from __future__ import absolute_import
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import urchin.fs.urchinfs as urchinfs
+from urchin.fs.index import FacetIndex
+
+DURATION = 2 # seconds each client runs per measurement
+CLIENTS = [1, 2, 4, 8]
+
+def make_fs(n):
+    fs = urchinfs.UrchinFS()
+    fs.mount_configurations[0] = {"source": "/bench", "ready": True, "last_duration": None}
+    entries = [fs._make_entry(("/bench/%07d" % i, (), {
+            u"artist": set([u"artist %d" % (i % 1000)]),
+            u"year": set([u"%d" % (1930 + i % 90)]),
+            u"genre": set([u"genre %d" % (i % 20)])},
+            [u"album %d" % i])) for i in xrange(n)]
+    fs.snapshot = urchinfs.Snapshot(0, ((0, FacetIndex(entries)),))
+    return fs
+
+def lookup(fs, path):
+    for d in fs.readdir(path, 0):
+        pass
+    fs.getattr(path)
+
+def run_clients(clients, target, combine=sum):
+    """runs `target(client, stop)` in `clients` threads for `DURATION` seconds; returns their results, combined"""
+    stop = threading.Event()
+    results = [0] * clients
+    def client(i):
+        results[i] = target(i, stop)
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    time.sleep(DURATION)
+    stop.set()
+    for t in threads:
+        t.join()
+    return combine(results)
+
+def cached(fs, paths):
+    for path in paths:
+        lookup(fs, path)
+    def target(i, stop):
+        n = 0
+        while not stop.is_set():
+            lookup(fs, paths[n % len(paths)])
+            n = n + 1
+        return n
+    return target
+
+def cold(fs, clients):
+    # each client walks its own share of the artist directories below each year, none of which is cached
+    paths = [u"/^/year/%d/^/artist/artist %d" % (year, artist) for artist in range(1000) for year in range(1930, 2020)]
+    def target(i, stop):
+        n = 0
+        for path in paths[i::clients]:
+            if stop.is_set():
+                break
+            lookup(fs, path.encode("utf-8"))
+            n = n + 1
+        return n
+    return target
+
+def rebuild_root(fs):
+    for name in ("_get_results_from_parts", "_get_listing_from_parts", "_get_stat_from_parts"):
+        fs.cache.pop((name, ()))
+    lookup(fs, "/")
+
+def isolation(fs, paths):
+    for path in paths:
+        lookup(fs, path)
+    def target(i, stop):
+        if i == 0:
+            # the slow client: rebuilds the root listing, as after a refresh
+            while not stop.is_set():
+                rebuild_root(fs)
+            return 0
+        worst = 0
+        n = 0
+        while not stop.is_set():
+            start = time.time()
+            lookup(fs, paths[n % len(paths)])
+            worst = max(worst, time.time() - start)
+            n = n + 1
+        return worst
+    return target
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    fs = make_fs(n)
+    paths = ["/^", "/^/genre", "/^/year/1948", "/^/genre/genre 3/^/year"]
+    print "%d entries, %ds per measurement" % (n, DURATION)
+    start = time.time()
+    rebuild_root(fs)
+    print "served from a single thread, a lookup queued behind a root rebuild waits %.1fms" % ((time.time() - start) * 1000)
+    for clients in CLIENTS:
+        hits = run_clients(clients, cached(fs, paths))
+        fs.cache.clear()
+        fs.states.clear()
+        misses = run_clients(clients, cold(fs, clients))
+        line = "%d clients: cached %.0f lookups/s, cold %.0f lookups/s" % (clients, hits / float(DURATION), misses / float(DURATION))
+        if clients > 1:
+            # with one slow client among them, the worst latency of the others
+            worst = run_clients(clients, isolation(fs, paths), max)
+            line = line + ", worst cached latency during root rebuilds %.1fms" % (worst * 1000)
+        print line
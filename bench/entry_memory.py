@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reports the memory taken per entry by the attribute-based `Entry`/`Result` classes which
+the filesystem used to keep, and by the current tuple-based ones, for mp3file-like items
+with six metadata keys, one source and one name.
+
+- "structure" builds the entries from prebuilt inputs, so counts only the entries themselves.
+- "total" builds each entry from freshly made strings and sets, as extraction does, so also
+  counts the metadata: kept as extracted before, encoded by a `Dictionary` now.
+
+Each variant is measured in its own process, as the growth of its resident set size (Linux only).
+
+usage: python bench/entry_memory.py [entries]    (default: 200000)
+"""
+
+from __future__ import absolute_import
+import os
+import gc
+import sys
+import stat
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+class _immutable(type):
+    """the metaclass the old entries were made immutable with"""
+    def __init__(cls, classname, parents, attributes):
+        cls.__original_init__ = cls.__init__
+        cls.__original_setattr__ = cls.__setattr__
+        cls.__original_delattr__ = cls.__delattr__
+        cls.__immutable__ = True
+
+        def init(self, *args, **kwargs):
+            object.__setattr__(self, "__immutable__", False)
+            self.__original_init__(*args, **kwargs)
+            self.__immutable__ = True
+        def setattr(self, name, value):
+            if self.__immutable__:
+                raise TypeError("immutable")
+            self.__original_setattr__(name, value)
+        def delattr(self, name):
+            if self.__immutable__:
+                raise TypeError("immutable")
+            self.__original_delattr__(name)
+
+        cls.__init__ = init
+        cls.__setattr__ = setattr
+        cls.__delattr__ = delattr
+
+class OldEntry(object):
+    """the old `Entry`, with an instance dict and a list of `OldResult`s"""
+    __metaclass__ = _immutable
+    def __init__(self, path, metadata_paths, metadata, name_tuples):
+        self.path = path
+        self.metadata_paths = metadata_paths
+        self.metadata = metadata
+        self.name_tuples = name_tuples
+        self.results = [OldResult("%s (%s)" % (name, idx) if idx != 0 else name, self.path) for name,idx in self.name_tuples]
+
+class OldResult(object):
+    """the old `Result`, with an instance dict"""
+    def __init__(self, name, destination=None):
+        self.name = name
+        self.destination = destination
+        self.mode = (stat.S_IFLNK | 0777) if self.destination else (stat.S_IFDIR | 0755)
+        self.size = len(name) if self.destination else 4096
+
+def rss():
+    return int(open("/proc/self/statm").read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def item(i):
+    """the path, metadata and name of the `i`th item, made afresh"""
+    path = "/srv/music/artist%04d/album%03d/%02d - track.mp3" % (i // 1000, (i // 10) % 100, i % 10)
+    metadata = {u"artist": set([u"artist %d" % (i // 1000)]), u"album": set([u"album %d" % ((i // 10) % 100)]),
+            u"title": set([u"title %d" % i]), u"tracknumber": set([u"%d" % (i % 10)]),
+            u"date": set([u"19%02d" % (i % 100)]), u"genre": set([u"Rock"])}
+    return path, metadata, u"%02d - artist %d - title %d" % (i % 10, i // 1000, i)
+
+def measure(variant, n):
+    """bytes per entry for `variant`, one of (old|new)-(structure|total)"""
+    from urchin.fs.urchinfs import Entry
+    from urchin.fs.index import Dictionary
+    old = variant.startswith("old")
+    dictionary = Dictionary()
+    inputs = None
+    if variant.endswith("structure"):
+        inputs = []
+        for i in xrange(n):
+            path,metadata,name = item(i)
+            inputs.append((path, metadata if old else dictionary.encode_metadata(metadata), name))
+    gc.collect()
+    before = rss()
+    entries = []
+    for i in xrange(n):
+        path,metadata,name = inputs[i] if inputs else item(i)
+        if old:
+            entries.append(OldEntry(path, set([path]), metadata, [(name, 0)]))
+        else:
+            if not inputs:
+                metadata = dictionary.encode_metadata(metadata)
+            entries.append(Entry(path, (path,), metadata, [(name, 0)]))
+    gc.collect()
+    return (rss() - before) // n
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        print measure(sys.argv[1], int(sys.argv[2]))
+        sys.exit(0)
+    n = sys.argv[1] if len(sys.argv) > 1 else "200000"
+    print "%s entries" % n
+    for kind in ("structure", "total"):
+        sizes = [int(subprocess.check_output([sys.executable, os.path.abspath(__file__), "%s-%s" % (version, kind), n]))
+                for version in ("old", "new")]
+        print "  %s: %d -> %d bytes per entry" % (kind, sizes[0], sizes[1])
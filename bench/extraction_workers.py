@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Measures the throughput of indexing, in items/s, with the mp3 and tmdb plugins at 1, 4 and 16
+workers, on a synthetic library written to a temporary directory: albums of tagged mp3 files
+for mp3, each album being an item, and directories of tmdb json files for tmdb.
+The extraction cache is not used.
+
+Before each run the page cache is dropped, which needs root; otherwise the runs read from a
+warm page cache, which hides the I/O the workers overlap, and the report says so.
+The names listed are checked to be the same at every worker count.
+
+usage: python bench/extraction_workers.py [items]    (default: 3000)
+"""
+
+from __future__ import absolute_import
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+import urchin.fs.urchinfs as urchinfs
+from mutagen.easyid3 import EasyID3
+
+WORKERS = [1, 4, 16]
+TRACKS = 10 # mp3 files per album
+# a silent MPEG-1 layer III frame at 128kbit/s, 44.1kHz, and enough of them for a few seconds of audio
+MP3_FRAME = "\xff\xfb\x90\x64" + "\x00" * 413
+MP3_FRAMES = 100
+
+def make_mp3_library(root, albums):
+    for album in xrange(albums):
+        directory = os.path.join(root, "artist %d" % (album // 10), "album %d" % album)
+        os.makedirs(directory)
+        for track in xrange(TRACKS):
+            path = os.path.join(directory, "%02d.mp3" % track)
+            with open(path, "wb") as f:
+                f.write(MP3_FRAME * MP3_FRAMES)
+            tags = EasyID3()
+            tags.update({"artist": u"artist %d" % (album // 10), "album": u"album %d" % album,
+                "title": u"title %d" % track, "tracknumber": u"%d" % (track + 1),
+                "date": u"%d" % (1960 + album % 60), "genre": u"genre %d" % (album % 20)})
+            tags.save(path)
+
+def make_tmdb_library(root, movies):
+    for movie in xrange(movies):
+        directory = os.path.join(root, "m%05d" % movie)
+        os.makedirs(directory)
+        with open(os.path.join(directory, "movie.json"), "w") as f:
+            json.dump({"title": "Movie %d" % movie, "original_title": "Movie %d" % movie,
+                "release_date": "%d-01-01" % (1930 + movie % 90), "runtime": 80 + movie % 60,
+                "original_language": "en", "imdb_id": "tt%d" % movie,
+                "genres": [{"name": "genre %d" % (movie % 20)}], "production_countries": [{"iso_3166_1": "GB"}]}, f)
+        with open(os.path.join(directory, "credits.json"), "w") as f:
+            json.dump({"crew": [{"job": "Director", "name": "Director %d" % (movie % 100)}]}, f)
+
+def drop_page_cache():
+    """drops the page cache, returning false if not allowed to"""
+    os.system("sync")
+    try:
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+        return True
+    except IOError:
+        return False
+
+def index(plugin, source, workers):
+    """indexes `source` with `plugin` on `workers` workers, returning the seconds it took and the names listed"""
+    fs = urchinfs.UrchinFS()
+    fs.plugins = fs._load_plugins()
+    fs.plugin_components = fs._find_plugin_components()
+    components = fs._configure_components({"source": source, "plugin": plugin})
+    start = time.time()
+    entries = fs._make_entries(components, source, workers=workers)
+    return time.time() - start, sorted(r.name for entry in entries for r in entry.results)
+
+def bench(plugin, source, items):
+    cold = True
+    names = None
+    for workers in WORKERS:
+        cold = drop_page_cache() and cold
+        elapsed,listed = index(plugin, source, workers)
+        assert names is None or listed == names, "names differ at %d workers" % workers
+        names = listed
+        print "  %s, %2d workers: %.0f items/s" % (plugin, workers, items / elapsed)
+    return cold
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    root = tempfile.mkdtemp(prefix="urchin-bench-")
+    try:
+        make_mp3_library(os.path.join(root, "mp3"), n // TRACKS)
+        make_tmdb_library(os.path.join(root, "tmdb"), n)
+        print "%d mp3 files in %d albums, %d tmdb directories" % (n // TRACKS * TRACKS, n // TRACKS, n)
+        cold = bench("mp3", os.path.join(root, "mp3"), n // TRACKS)
+        cold = bench("tmdb", os.path.join(root, "tmdb"), n) and cold
+        print "page cache dropped before each run" if cold else "page cache NOT dropped (needs root): the runs read from memory"
+    finally:
+        shutil.rmtree(root)
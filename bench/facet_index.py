@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares the list-filter loop which `_get_results_from_parts` used to narrow entries by a facet
+with `FacetIndex.match` over bitmap/frozenset postings, on synthetic entries with year, genre,
+language and title keys.
+
+usage: python bench/facet_index.py [entries ...]    (default: 100000 1000000)
+"""
+
+from __future__ import absolute_import
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from urchin.fs.index import FacetIndex, Dictionary, count
+
+class BenchEntry(object):
+    """the parts of an entry the filters read: its raw metadata for the loop, encoded for the index"""
+    __slots__ = ("metadata", "raw", "results")
+    def __init__(self, raw, metadata):
+        self.raw = raw
+        self.metadata = metadata
+        self.results = ()
+
+def list_filter(found, key, values):
+    """the loop which filtered the entries by one facet before the index"""
+    newfound = []
+    for e in found:
+        keep = False
+        if key in e.raw:
+            for v in values:
+                if v in e.raw[key]:
+                    keep = True
+        if keep:
+            newfound.append(e)
+    return newfound
+
+def best(f, repeat=3):
+    """the fastest of `repeat` runs of `f`, in seconds, and its result"""
+    fastest = None
+    for _ in range(repeat):
+        start = time.time()
+        result = f()
+        elapsed = time.time() - start
+        fastest = elapsed if fastest is None else min(fastest, elapsed)
+    return fastest, result
+
+def bench(n):
+    random.seed(0)
+    dictionary = Dictionary()
+    entries = []
+    for i in xrange(n):
+        raw = {"year": set([str(random.randint(1930, 2020))]),
+                "genre": set(random.sample(["a", "b", "c", "d", "e", "f"], 2)),
+                "lang": set([random.choice(["en", "fr", "de", "ja"])]),
+                "title": set(["t%d" % i])}
+        entries.append(BenchEntry(raw, dictionary.encode_metadata(raw)))
+    start = time.time()
+    index = FacetIndex(entries)
+    print "n=%d: index built in %.2fs" % (n, time.time() - start)
+
+    def match(ids, key, values):
+        return index.match(dictionary.lookup(key), [dictionary.lookup(v) for v in values], ids)
+    queries = [
+            ("narrow (year OR, genre, lang)",
+                lambda: len(list_filter(list_filter(list_filter(entries, "year", ["1948", "1955"]), "genre", ["a"]), "lang", ["en"])),
+                lambda: count(match(match(match(index.all, "year", ["1948", "1955"]), "genre", ["a"]), "lang", ["en"]))),
+            ("broad (lang OR, genre OR)",
+                lambda: len(list_filter(list_filter(entries, "lang", ["en", "fr"]), "genre", ["a", "b"])),
+                lambda: count(match(match(index.all, "lang", ["en", "fr"]), "genre", ["a", "b"]))),
+            ]
+    for name,loop,indexed in queries:
+        loop_time,loop_count = best(loop)
+        index_time,index_count = best(indexed)
+        assert loop_count == index_count, (loop_count, index_count)
+        print "  %s: list-filter %.1fms, index %.2fms (%d results)" % (name, loop_time * 1000, index_time * 1000, index_count)
+
+if __name__ == "__main__":
+    for n in [int(arg) for arg in sys.argv[1:]] or [10**5, 10**6]:
+        bench(n)
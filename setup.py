@@ -11,5 +11,5 @@ setup(
         url='https://github.com/kellen/urchinfs/',
         packages=['urchin', 'urchin.fs', 'urchin.tmdb'],
         license='Public Domain',
-        install_requires=['googlesearch', 'requests', 'fuse-python']
+        install_requires=['googlesearch', 'requests', 'fuse-python', 'scandir']
         )
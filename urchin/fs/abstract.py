@@ -3,34 +3,90 @@
 
 from __future__ import absolute_import
 import os
-from fnmatch import fnmatch
 from urchin.fs.plugin import Indexer, MetadataMatcher
+from urchin.fs.walk import walk, listdir, glob_pattern
 
-class AbstractDirectoryIndexer(Indexer):
-    """Recursively finds directories in path which have a child file which matches the glob"""
+def option_globs(config, option):
+    """the list of globs in the `option` of `config`, either a list or a string of globs separated by ':'"""
+    globs = config.get(option, [])
+    if isinstance(globs, basestring):
+        globs = [glob for glob in globs.split(":") if glob]
+    return globs
+
+def file_name_pattern(config, glob):
+    """
+    compiles the regex matching the names of the files a component is interested in:
+    those matching `glob` (a glob or a list of globs), or the "include" option's globs if it is set,
+    and none of the "exclude" option's globs
+    """
+    include = option_globs(config, "include") or ([glob] if isinstance(glob, basestring) else list(glob))
+    return glob_pattern(include, option_globs(config, "exclude"))
+
+class AbstractWalkingIndexer(Indexer):
+    """
+    Recursively walks path and finds the items in each directory separately,
+    which allows the items of a directory to be reused while it is unchanged
+
+    Directories whose name matches one of the globs in the "prune" option (separated by ':')
+    are not walked, nor are directories more than "maxdepth" levels below path, unless it is 0.
+    """
+    prune = None
+    maxdepth = 0
+    def __init__(self, config):
+        self.prune = glob_pattern(option_globs(config, "prune"))
+        self.maxdepth = int(config.get("maxdepth", 0))
+    def index(self, path):
+        for dirpath,filenames in walk(path, self.prune, self.maxdepth):
+            for item in self.index_directory(dirpath, filenames):
+                yield item
+    def index_below(self, path, directory):
+        """
+        Yields the items in and below `directory` which indexing `path` would find: none if `directory`
+        is not below `path` or is (below) a pruned directory, and none deeper than "maxdepth" below `path`
+        """
+        parts = [part for part in os.path.relpath(directory, path).split(os.sep) if part != os.curdir]
+        if os.pardir in parts or (self.prune and any(self.prune.match(part) for part in parts)):
+            return
+        if self.maxdepth and len(parts) > self.maxdepth:
+            return
+        for dirpath,filenames in walk(directory, self.prune, self.maxdepth, len(parts)):
+            for item in self.index_directory(dirpath, filenames):
+                yield item
+    def index_directory(self, dirpath, filenames):
+        """Return a list of the items in the directory `dirpath`, which contains the files `filenames`"""
+        raise NotImplementedError()
+
+class AbstractDirectoryIndexer(AbstractWalkingIndexer):
+    """Recursively finds directories in path which have a child file whose name matches the glob(s)"""
     def __init__(self, config, glob):
+        super(AbstractDirectoryIndexer, self).__init__(config)
         self.glob = glob;
-    def index(self, path):
-        return [x[0] for x in os.walk(path) if [f for f in x[2] if fnmatch(f, self.glob)]]
+        self._match = file_name_pattern(config, glob).match
+    def index_directory(self, dirpath, filenames):
+        # stops testing at the first match
+        return [dirpath] if any(self._match(f) for f in filenames) else []
 
-class AbstractFileIndexer(Indexer):
-    """Recursively finds files which match the glob"""
+class AbstractFileIndexer(AbstractWalkingIndexer):
+    """Recursively finds files whose name matches the glob(s)"""
     def __init__(self, config, glob):
+        super(AbstractFileIndexer, self).__init__(config)
         self.glob = glob
-    def index(self, path):
-        paths = [[os.path.join(walked[0], filename) for filename in walked[2]] for walked in os.walk(path)]
-        flattened = [file for sublist in paths for file in sublist]
-        filtered = [file for file in flattened if fnmatch(file, self.glob)]
-        return filtered
+        self._match = file_name_pattern(config, glob).match
+    def index_directory(self, dirpath, filenames):
+        match = self._match
+        return [os.path.join(dirpath, filename) for filename in filenames if match(filename)]
 
 class AbstractFileMetadataMatcher(MetadataMatcher):
     """
-    If `path` is a directory, returns the paths of files which are children and which match `glob`,
+    If `path` is a directory, returns the paths of files which are children and whose name matches the glob(s),
     otherwise returns an empty list.
     """
     def __init__(self,config, glob):
         self.glob = glob
+        self._match = file_name_pattern(config, glob).match
     def match(self, path):
-        if os.path.isdir(path):
-            return set([os.path.join(path, x) for x in os.listdir(path) if fnmatch(x, self.glob)])
-        return set()
+        try:
+            _,filenames = listdir(path)
+        except OSError: # e.g. not a directory
+            return set()
+        return set([os.path.join(path, filename) for filename in filenames if self._match(filename)])
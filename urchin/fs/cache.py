@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import time
+import threading
+import collections
+
+class LRUCache(object):
+    """
+    Bounded cache which evicts the least recently used key.
+
+    Keys must be hashable. A key expires `expire` seconds after it was last stored
+    or used; 0 never expires. At most `max_entries` keys are kept; 0 is unbounded.
+    Since the keys are ordered by last use, both expiry and eviction only ever
+    look at the oldest keys, which keeps every operation O(1) amortized.
+    All operations are atomic, so the cache may be shared between threads.
+    """
+    def __init__(self, max_entries=0, expire=0):
+        self.max_entries = max_entries
+        self.expire = expire
+        self._data = collections.OrderedDict() # key -> (value, last use), oldest first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._expire(time.time())
+            return key in self._data
+
+    def keys(self):
+        with self._lock:
+            return self._data.keys()
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if key not in self._data:
+                self.misses = self.misses + 1
+                return default
+            self.hits = self.hits + 1
+            value,_ = self._data.pop(key)
+            self._data[key] = (value, now)
+            return value
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            self._data.pop(key, None)
+            self._data[key] = (value, now)
+            while self.max_entries > 0 and len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions = self.evictions + 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value,_ = self._data.pop(key)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _expire(self, now):
+        if self.expire <= 0:
+            return
+        while self._data:
+            key,(_,last_use) = next(self._data.iteritems())
+            if now - last_use < self.expire:
+                break
+            del self._data[key]
+            self.expirations = self.expirations + 1
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+import logging
+import sqlite3
+import threading
+import cPickle as pickle
+
+class ExtractionCache(object):
+    """
+    Persistent cache of extractor output, stored in a sqlite database at `path`.
+
+    Output is keyed by source path and extractor name, and is only reused while
+    the source's (inode, size, mtime) and the extractor's `version` are unchanged.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.failed = False
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.text_factory = str
+            self._connection.execute("CREATE TABLE IF NOT EXISTS extracted ("
+                    "path TEXT, extractor TEXT, version TEXT, inode INTEGER, size INTEGER, mtime_ns INTEGER, metadata BLOB, "
+                    "PRIMARY KEY (path, extractor))")
+        return self._connection
+
+    def extract(self, extractor, path):
+        """returns the output of `extractor` for `path`, reusing the cached output if the source is unchanged"""
+        if self.failed:
+            return extractor.extract(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return extractor.extract(path)
+        name = getattr(extractor, "name", type(extractor).__name__)
+        version = str(getattr(extractor, "version", 0))
+        mtime_ns = getattr(st, "st_mtime_ns", int(st.st_mtime * 10**9))
+        key = (path, name, version, st.st_ino, st.st_size, mtime_ns)
+        try:
+            with self._lock:
+                row = self._connect().execute("SELECT metadata FROM extracted WHERE path = ? AND extractor = ? AND version = ? "
+                        "AND inode = ? AND size = ? AND mtime_ns = ?", key).fetchone()
+                # counted under the lock, since the workers extract concurrently
+                if row is not None:
+                    self.hits = self.hits + 1
+                else:
+                    self.misses = self.misses + 1
+        except (sqlite3.Error, OSError), e:
+            self._fail(e)
+            return extractor.extract(path)
+        if row is not None:
+            return pickle.loads(str(row[0]))
+        metadata = extractor.extract(path)
+        try:
+            with self._lock:
+                self._connect().execute("INSERT OR REPLACE INTO extracted VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        key + (buffer(pickle.dumps(metadata, pickle.HIGHEST_PROTOCOL)),))
+        except (sqlite3.Error, OSError, pickle.PicklingError), e:
+            self._fail(e)
+        return metadata
+
+    def _fail(self, e):
+        logging.warning("extraction cache %s unusable, extracting without it: %s" % (self.path, e))
+        self.failed = True
+
+    def commit(self):
+        """writes out pending results and closes the database until its next use"""
+        with self._lock:
+            if self._connection is not None:
+                try:
+                    self._connection.commit()
+                    self._connection.close()
+                except sqlite3.Error, e:
+                    logging.warning("could not write extraction cache %s: %s" % (self.path, e))
+                self._connection = None
+        logging.debug("extraction cache hits: %d misses: %d" % (self.hits, self.misses))
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import binascii
+import threading
+import itertools
+
+# a set of entry ids is stored either as a bitmap (a python int/long where bit `i` is set
+# if entry `i` is a member) or, when it is much smaller than the index, as a frozenset of ids.
+# a bitmap costs one bit per entry in the index while a frozenset costs roughly
+# SPARSE_RATIO bits per member, so whichever is cheaper is used.
+SPARSE_RATIO = 256
+
+def bitmap(ids):
+    """builds a bitmap from an iterable of ids"""
+    ids = list(ids)
+    if not ids:
+        return 0
+    buf = bytearray((max(ids) >> 3) + 1)
+    for i in ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    buf.reverse()
+    return int(binascii.hexlify(buf), 16)
+
+def idset(ids, size):
+    """builds the cheaper representation of the ids in the list `ids` for an index with `size` entries"""
+    if len(ids) * SPARSE_RATIO < size:
+        return frozenset(ids)
+    return bitmap(ids)
+
+def _membership(ids):
+    """returns a function testing membership of an id in the id set `ids`"""
+    if isinstance(ids, frozenset):
+        return ids.__contains__
+    bits = bin(ids)[:1:-1]
+    size = len(bits)
+    return lambda i: i < size and bits[i] == "1"
+
+def intersection(a, b):
+    """AND of two id sets"""
+    a_sparse = isinstance(a, frozenset)
+    b_sparse = isinstance(b, frozenset)
+    if a_sparse and b_sparse:
+        return a & b
+    if a_sparse or b_sparse:
+        sparse,dense = (a,b) if a_sparse else (b,a)
+        test = _membership(dense)
+        return frozenset([i for i in sparse if test(i)])
+    return a & b
+
+def union(a, b):
+    """OR of two id sets"""
+    a_sparse = isinstance(a, frozenset)
+    b_sparse = isinstance(b, frozenset)
+    if a_sparse and b_sparse:
+        return a | b
+    if a_sparse:
+        a = bitmap(a)
+    if b_sparse:
+        b = bitmap(b)
+    return a | b
+
+def members(ids):
+    """yields the ids in the id set `ids` in ascending order"""
+    if isinstance(ids, frozenset):
+        for i in sorted(ids):
+            yield i
+        return
+    bits = bin(ids)[:1:-1]
+    i = bits.find("1")
+    while i != -1:
+        yield i
+        i = bits.find("1", i + 1)
+
+def contains(ids, i):
+    """true if the id `i` is in the id set `ids`"""
+    if isinstance(ids, frozenset):
+        return i in ids
+    return (ids >> i) & 1 == 1
+
+def count(ids):
+    """the number of ids in the id set `ids`"""
+    if isinstance(ids, frozenset):
+        return len(ids)
+    return bin(ids).count("1")
+
+class Dictionary(object):
+    """
+    Interns the metadata keys and values of every index as small integers, so that each distinct
+    string and set of values is stored once, however many entries have it, and is compared as an int.
+
+    Codes are never reused, so the dictionary only grows, by the strings which were ever indexed.
+    Only one thread may encode at a time, but any thread may look up or decode concurrently.
+    """
+    def __init__(self):
+        self.codes = {} # string -> code
+        self.strings = [] # code -> string
+        self._value_sets = {} # frozenset of codes -> the same, shared frozenset
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.strings)
+
+    def encode(self, string):
+        """the code for `string`, adding it if it is new"""
+        code = self.codes.get(string)
+        if code is None:
+            with self._lock:
+                code = self.codes.get(string)
+                if code is None:
+                    code = len(self.strings)
+                    # decodable before it can be looked up
+                    self.strings.append(string)
+                    self.codes[string] = code
+        return code
+
+    def lookup(self, string):
+        """the code for `string`, or None if it was never encoded"""
+        return self.codes.get(string)
+
+    def decode(self, code):
+        return self.strings[code]
+
+    def encode_metadata(self, metadata):
+        """encodes a dict of key -> set of values as `Metadata` of key code -> shared frozenset of value codes"""
+        encoded = []
+        for key,values in metadata.iteritems():
+            codes = frozenset([self.encode(value) for value in values])
+            encoded.append((self.encode(key), self._value_sets.setdefault(codes, codes)))
+        return Metadata(encoded)
+
+    def decode_metadata(self, metadata):
+        """the inverse of `encode_metadata`"""
+        return {self.strings[key]: set([self.strings[value] for value in values]) for key,values in metadata.iteritems()}
+
+class Metadata(tuple):
+    """
+    Compact, immutable mapping of key code -> frozenset of value codes, for the metadata of an entry.
+
+    Entries rarely have more than a handful of keys, so rather than a dict it is a flat tuple of
+    alternating keys and values, ordered by key, which makes equal metadata compare equal.
+    Since a key never equals a value, `tuple.index` finds a key in C.
+    """
+    __slots__ = ()
+    def __new__(cls, items=()):
+        return tuple.__new__(cls, [x for item in sorted(items) for x in item])
+    def get(self, key, default=None):
+        try:
+            return self[self.index(key) + 1]
+        except ValueError:
+            return default
+    def __contains__(self, key):
+        return key in self[::2]
+    def keys(self):
+        return list(self[::2])
+    def iterkeys(self):
+        return itertools.islice(self, 0, None, 2)
+    def itervalues(self):
+        return itertools.islice(self, 1, None, 2)
+    def iteritems(self):
+        return itertools.izip(self.iterkeys(), self.itervalues())
+    def __repr__(self):
+        return "Metadata(%r)" % list(self.iteritems())
+
+class FacetIndex(object):
+    """
+    Inverted index over the metadata of a list of entries.
+
+    Entries are identified by their position in `entries`.
+    `postings` maps key -> value -> id set of the entries having that value,
+    `key_postings` maps key -> id set of the entries which have any value for the key.
+    See `idset` for the id set representation.
+    Keys and values are whatever the entries' metadata holds, i.e. the codes of a `Dictionary`.
+    `names` maps the name of each result to the id of the entry listing it, or to a tuple of ids
+    in the rare case that several entries list the same name.
+    """
+    def __init__(self, entries):
+        self.entries = entries
+        size = len(entries)
+        self.all = (1 << size) - 1
+        postings = {}
+        key_postings = {}
+        names = {}
+        for entry_id,entry in enumerate(entries):
+            for result in entry.results:
+                other = names.setdefault(result.name, entry_id)
+                if other != entry_id:
+                    names[result.name] = (other if isinstance(other, tuple) else (other,)) + (entry_id,)
+            for key,values in entry.metadata.iteritems():
+                key_postings.setdefault(key, []).append(entry_id)
+                by_value = postings.setdefault(key, {})
+                for value in values:
+                    by_value.setdefault(value, []).append(entry_id)
+        self.key_postings = {key: idset(ids, size) for key,ids in key_postings.iteritems()}
+        self.postings = {key: {value: idset(ids, size) for value,ids in by_value.iteritems()} for key,by_value in postings.iteritems()}
+        self.names = names
+
+    def keys(self, ids):
+        """the keys for which at least one of the entries in `ids` has a value"""
+        keys = set()
+        if isinstance(ids, frozenset):
+            for entry_id in ids:
+                keys.update(self.entries[entry_id].metadata.iterkeys())
+            return keys
+        test = None
+        for key,posting in self.key_postings.iteritems():
+            if isinstance(posting, frozenset):
+                test = test or _membership(ids)
+                if any(test(i) for i in posting):
+                    keys.add(key)
+            elif posting & ids:
+                keys.add(key)
+        return keys
+
+    def values(self, key, ids):
+        """the values for `key` of the entries in `ids`"""
+        if key not in self.postings:
+            return set()
+        by_value = self.postings[key]
+        if ids == self.all:
+            return set(by_value.keys())
+        if isinstance(ids, frozenset) or count(ids) < len(by_value):
+            # walk the entries rather than the postings so the cost follows the result size
+            values = set()
+            for entry_id in members(ids):
+                values.update(self.entries[entry_id].metadata.get(key, ()))
+            return values
+        test = _membership(ids)
+        values = set()
+        for value,posting in by_value.iteritems():
+            if isinstance(posting, frozenset):
+                if any(test(i) for i in posting):
+                    values.add(value)
+            elif intersection(posting, ids):
+                values.add(value)
+        return values
+
+    def counts(self, key, ids):
+        """the number of the entries in `ids` having each of their values for `key`"""
+        by_value = self.postings.get(key, {})
+        if ids == self.all:
+            return {value: count(posting) for value,posting in by_value.iteritems()}
+        counts = {}
+        if isinstance(ids, frozenset) or count(ids) < len(by_value):
+            for entry_id in members(ids):
+                for value in self.entries[entry_id].metadata.get(key, ()):
+                    counts[value] = counts.get(value, 0) + 1
+            return counts
+        test = _membership(ids)
+        for value,posting in by_value.iteritems():
+            if isinstance(posting, frozenset):
+                n = sum(1 for i in posting if test(i))
+            else:
+                n = count(posting & ids)
+            if n:
+                counts[value] = n
+        return counts
+
+    def match(self, key, values, ids):
+        """the ids in `ids` of the entries which have any of `values` for `key`"""
+        by_value = self.postings.get(key, {})
+        matched = frozenset()
+        for value in values:
+            if value in by_value:
+                matched = union(matched, by_value[value])
+        return intersection(matched, ids)
+
+    def entry(self, name, ids):
+        """the first of the entries in `ids` which has a result named `name`, or None"""
+        entry_ids = self.names.get(name, ())
+        for entry_id in entry_ids if isinstance(entry_ids, tuple) else (entry_ids,):
+            if contains(ids, entry_id):
+                return self.entries[entry_id]
+        return None
+
+    def results(self, ids):
+        """the results of the entries in `ids`, in entry order"""
+        return [result for entry_id in members(ids) for result in self.entries[entry_id].results]
@@ -19,7 +19,10 @@ class Indexer(object):
     def __init__(self, config):
         pass
     def index(self, path):
-        """Return a list of paths to be indexed"""
+        """
+        Return an iterable of paths to be indexed. If it is a generator, items are
+        extracted as they are found, without the whole list ever being held in memory.
+        """
         raise NotImplementedError()
 
 class MetadataMatcher(object):
@@ -32,8 +35,14 @@ class MetadataMatcher(object):
         raise NotImplementedError()
 
 class MetadataExtractor(object):
-    """Metadata extractor"""
+    """
+    Metadata extractor
+
+    Extracted metadata is cached between mounts; bump `version` whenever
+    the output for an unchanged file would change.
+    """
     component = "extractor"
+    version = 0
     def __init__(self, config):
         pass
     def extract(self, path):
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import time
+import threading
+
+class Stats(object):
+    """
+    Named counters and cumulative timings, in seconds, kept while mounted.
+    All operations are atomic, so they may be updated from any thread; timings of work
+    done concurrently add up, so may exceed the time which passed.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.times = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def add_times(self, times):
+        """adds each of the (name, seconds) pairs in `times`"""
+        with self._lock:
+            for name,seconds in times:
+                self.times[name] = self.times.get(name, 0) + seconds
+
+    def add_time(self, name, seconds):
+        self.add_times([(name, seconds)])
+
+    def timed(self, name, iterable):
+        """yields the items of `iterable`, adding the time spent producing them to `name`"""
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.time() - start)
+                return
+            self.add_time(name, time.time() - start)
+            yield item
+
+    def copy(self):
+        """a consistent copy of the counts and times"""
+        with self._lock:
+            return dict(self.counts), dict(self.times)
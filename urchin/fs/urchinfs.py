@@ -14,7 +14,15 @@ import pprint
 import fuse
 import imp
 import time
+import datetime
+import copy
 import functools
+import itertools
+import operator
+import threading
+from json import dumps as json_dumps
+from multiprocessing.pool import ThreadPool
+import _strptime # imported lazily by datetime.strptime, which is not thread-safe
 
 from urchin import __version__
 import urchin.fs.plugin as plugin
@@ -23,41 +31,57 @@ import urchin.fs.mp3 as mp3
 import urchin.fs.mp3file as mp3file
 import urchin.fs.json as json
 import urchin.fs.tmdb as tmdb
+import urchin.fs.watch as watch
 from urchin.fs.core import Stat, TemplateFS
+from urchin.fs.index import FacetIndex, Dictionary, Metadata
+from urchin.fs.cache import LRUCache
+from urchin.fs.stats import Stats
+from urchin.fs.extractcache import ExtractionCache
+from urchin.fs.walk import DirectoryTracker, walk_items
+from urchin.fs.abstract import AbstractWalkingIndexer
 
 # FIXME unit tests
 
 logging.basicConfig()
 fuse.fuse_python_api = (0, 2)
 
+_MISSING = object()
+_EXTRACT_CHUNKSIZE = 16
+_EXTRACT_BATCH_CHUNKS = 4 # chunks per worker in each batch handed to the extraction pool
+_MIN_REFRESH_WAIT = 1
+_PROGRESS_INTERVAL = 5 # seconds between the partial snapshots published while indexing in the background
+_STATIC_TIMEOUT = 3600 # seconds the kernel caches lookups and attributes when no mount ever changes
+_KERNEL_TIMEOUTS = ["entry_timeout", "attr_timeout", "negative_timeout"]
+# options for which 0 is a setting, e.g. no expiry or no size limit, rather than unset
+_ZERO_OPTIONS = ["expire", "cachesize"] + _KERNEL_TIMEOUTS
+
 def cache(obj):
-    """modified https://wiki.python.org/moin/PythonDecoratorLibrary#Alternate_memoize_as_nested_functions"""
+    """
+    memoizes a lookup method in the instance's `cache`, keyed by the method name and its (hashable) arguments.
+    the first argument is the snapshot the lookup reads, which is not part of the key; see `_cache_put`
+    """
     @functools.wraps(obj)
-    def cacher(self, *args, **kwargs):
-        self.cache_init()
-
-        now = time.time()
-        before = len(self.cache.keys())
-        self.cache = {key: val for key,val in self.cache.items() if now - val[1] < self.config["expire"]}
-        num_expired = before - len(self.cache.keys())
-        if num_expired > 0:
-            logging.debug("\texpired %d cache keys" % num_expired)
-
-        key = str(self) + str(obj) + str(args) + str(kwargs)
-        if key not in self.cache:
-            self.cachemisses = self.cachemisses + 1
-            logging.debug("\tcache miss. hits: %d misses: %d" % (self.cachehits, self.cachemisses))
-            ret = obj(self, *args, **kwargs)
-            self.cache[key] = (ret , time.time())
+    def cacher(self, snapshot, *args):
+        key = (obj.__name__,) + args
+        val = self.cache.get(key, _MISSING)
+        if val is _MISSING:
+            logging.debug("\tcache miss. hits: %d misses: %d" % (self.cache.hits, self.cache.misses))
+            val = obj(self, snapshot, *args)
+            self._cache_put(snapshot, key, val)
         else:
-            val,_ = self.cache[key]
-            self.cache[key] = (val, time.time())
-            self.cachehits = self.cachehits + 1
-            logging.debug("\tcache hit. hits: %d misses: %d" % (self.cachehits, self.cachemisses))
-        val,_ = self.cache[key]
+            logging.debug("\tcache hit. hits: %d misses: %d" % (self.cache.hits, self.cache.misses))
         return val
     return cacher
 
+def counted(obj):
+    """counts the calls of a filesystem operation in the instance's `stats`"""
+    name = "op." + obj.__name__
+    @functools.wraps(obj)
+    def counter(self, *args, **kwargs):
+        self.stats.count(name)
+        return obj(self, *args, **kwargs)
+    return counter
+
 class UrchinFS(TemplateFS):
     def __init__(self, *args, **kwargs):
         self.component_types = self._find_component_types()
@@ -67,13 +91,27 @@ class UrchinFS(TemplateFS):
         self.config = {
                 "loglevel": "warning",
                 "expire": 3600,
+                "cachesize": 10000,
+                "extractcache": "~/.urchin/extract.sqlite",
+                "multithreaded": 0,
+                "background": 0,
                 "plugindir": ["~/.urchin/plugins/"]
                 }
         self.mount_configurations = {}
         self.plugins = {}
         self.plugin_components = {}
-        self._disambiguation = dict()
+        self._disambiguation = dict() # only used while making entries, under `_update_lock` once mounted
+        self.cache = LRUCache(self.config["cachesize"], self.config["expire"])
+        self.states = LRUCache(self.config["cachesize"], self.config["expire"]) # query states by path, of the current snapshot only
+        self.dictionary = Dictionary() # codes for the metadata keys and values of every entry
+        self.extraction_cache = None
+        self.stats = Stats()
         self.refresh = False
+        self.snapshot = Snapshot(0, ())
+        self.watchers = []
+        self._lock = threading.RLock()
+        self._update_lock = threading.Lock()
+        self._stopping = threading.Event()
 
         super(UrchinFS, self).__init__(*args, **kwargs)
         self.parser.add_option(mountopt="config", help="configuration file. if set, other options ignored")
@@ -81,31 +119,28 @@ class UrchinFS(TemplateFS):
         self.parser.add_option(mountopt="plugin", help="plugin name. if set, component options ignored")
         self.parser.add_option(mountopt="plugindir", help="directory in which to find plugins")
         self.parser.add_option(mountopt="refresh", type="int", default=0, help="time before doing a full refresh, in seconds. 0 (default) will not refresh")
+        self.parser.add_option(mountopt="workers", type="int", default=1, help="number of threads extracting metadata concurrently")
+        self.parser.add_option(mountopt="incremental", type="int", default=0, help="1 to only re-index directories whose mtime changed when refreshing")
+        self.parser.add_option(mountopt="watch", type="int", default=0, help="1 to re-index changed items as inotify reports changes to the source")
+        self.parser.add_option(mountopt="watchdelay", type="float", default=2, help="seconds without changes before changed items are re-indexed")
+        self.parser.add_option(mountopt="watchmaxdelay", type="float", default=10, help="seconds after a change by which changed items are re-indexed, even while changes continue")
+        self.parser.add_option(mountopt="prune", help="':'-separated globs of directory names not to walk into, e.g. .git:@eaDir:lost+found")
+        self.parser.add_option(mountopt="include", help="':'-separated globs of the file names to index, in place of the components' own")
+        self.parser.add_option(mountopt="exclude", help="':'-separated globs of the file names not to index")
+        self.parser.add_option(mountopt="maxdepth", type="int", default=0, help="number of directory levels below the source to walk; 0 (default) is unlimited")
         self.parser.add_option(mountopt="log", help="the file to which to log")
         self.parser.add_option(mountopt="loglevel", help="the log level", choices=['debug', 'info', 'warning', 'error', 'critical'])
         self.parser.add_option(mountopt="expire", type="int", default=3600, help="cache expire time in seconds; 0 will never expire")
+        self.parser.add_option(mountopt="cachesize", type="int", default=10000, help="maximum number of cached paths; 0 is unbounded")
+        self.parser.add_option(mountopt="extractcache", help="file in which to keep extracted metadata between mounts; 'off' disables")
+        self.parser.add_option(mountopt="multithreaded", type="int", default=0, help="1 to serve filesystem requests from multiple threads")
+        self.parser.add_option(mountopt="background", type="int", default=0, help="1 to mount immediately and index in the background")
+        self.parser.add_option(mountopt="entry_timeout", type="float", help="seconds the kernel caches name lookups; default follows the refresh interval")
+        self.parser.add_option(mountopt="attr_timeout", type="float", help="seconds the kernel caches attributes; default follows the refresh interval")
+        self.parser.add_option(mountopt="negative_timeout", type="float", help="seconds the kernel caches failed lookups; default follows the refresh interval")
         for k in self.component_keys:
             self.parser.add_option(mountopt=k, help="%s name" % k)
 
-    #
-    # cache
-    #
-    def cache_init(self):
-        if not getattr(self, "cache", None):
-            self.cache = {}
-        if not getattr(self, "cachehits", None):
-            self.cachehits = 0
-        if not getattr(self, "cachemisses", None):
-            self.cachemisses = 0
-
-
-    # FIXME ugly
-    def cache_reset(self):
-        self.cache_init()
-        self.cache = {}
-        self.cachehits = 0
-        self.cachemisses = 0
-
     #
     # Plugin/component handling
     #
@@ -260,15 +295,32 @@ class UrchinFS(TemplateFS):
             out.append((name, idx))
         return out
 
-    def _make_entry(self, item_path, components, old_entry=None):
+    def _extract_item(self, item_path, components):
+        """
+        runs the matcher, extractor, merger, munger and formatter for an item,
+        returning a tuple of (item_path, sources, metadata, cleaned formatted names).
+        touches no shared state but the (thread-safe) stats, so it may run concurrently for different items
+        """
+        start = time.time()
         sources = components["matcher"].match(item_path)
-        raw_metadata = {source: components["extractor"].extract(source) for source in sources}
+        matched = time.time()
+        raw_metadata = {source: self._extract(components["extractor"], source) for source in sources}
+        extracted = time.time()
         combined_metadata = components["merger"].merge(raw_metadata)
+        merged = time.time()
         metadata = components["munger"].mung(combined_metadata)
+        munged = time.time()
         metadata = self._clean_metadata(metadata)
 
+        cleaned = time.time()
         formatted_names = components["formatter"].format(item_path, metadata)
-        cleaned_formatted_names = self._clean_formatted_names(formatted_names)
+        self.stats.add_times([("stage.matcher", matched - start), ("stage.extractor", extracted - matched),
+                ("stage.merger", merged - extracted), ("stage.munger", munged - merged), ("stage.formatter", time.time() - cleaned)])
+        return (item_path, sources, metadata, self._clean_formatted_names(formatted_names))
+
+    def _make_entry(self, extracted, old_entry=None):
+        """makes the entry for an item extracted by `_extract_item`; must be called in item order"""
+        item_path, sources, metadata, cleaned_formatted_names = extracted
         disambiguated_cleaned_formatted_names = []
 
         if old_entry:
@@ -281,7 +333,12 @@ class UrchinFS(TemplateFS):
             cleaned_formatted_names = [name for name in cleaned_formatted_names if name not in remove]
 
         disambiguated_cleaned_formatted_names.extend(self._disambiguate_formatted_names(cleaned_formatted_names))
-        return Entry(item_path, sources, metadata, disambiguated_cleaned_formatted_names)
+        return Entry(item_path, sources, self.dictionary.encode_metadata(metadata), disambiguated_cleaned_formatted_names)
+
+    def _extract(self, extractor, source):
+        if self.extraction_cache:
+            return self.extraction_cache.extract(extractor, source)
+        return extractor.extract(source)
 
     def _clean_metadata(self, metadata):
         """
@@ -302,50 +359,200 @@ class UrchinFS(TemplateFS):
             md[newkey] = set(newvals)
         return md
 
-    def _make_entries(self, components, path, old_entries=None):
+    def _make_entries(self, components, path, old_entries=None, workers=1, tracker=None, progress=None, items=None):
         """
         make the entries for `path` given the defined `components`
         if `old_entries` is set, if a matching entry is found, its matching formatted paths are retained
+        if `tracker` is set, the old entries of items in unchanged directories are reused as they are
+        if `progress` is set, it is called with a copy of the entries made so far every `_PROGRESS_INTERVAL` seconds
+        if `items` is set, it holds the (item_path, unchanged) pairs for `path` and the indexer isn't used
+        items stream from the indexer through extraction as they are found, so only the entries
+        themselves are held in memory; indexers returning a list work the same way.
         """
+        start = time.time()
         entries = []
-        indexed = components["indexer"].index(path)
-        logging.debug("indexed path %s gave item paths: %s" % (path, pprint.pformat(indexed)))
-        for item_path in indexed:
-            from_old = False
-            if old_entries:
-                for old_entry in old_entries:
-                    if old_entry.path == item_path:
-                        from_old = True
-                        entries.append(self._make_entry(item_path, components, old_entry))
-                        break
-            if not from_old:
-                entries.append(self._make_entry(item_path, components))
-        logging.debug("entries: %s" % pprint.pformat(entries))
+        old_by_path = {entry.path: entry for entry in old_entries} if old_entries else {}
+        if items is None:
+            if tracker:
+                items = tracker.index(components["indexer"], path)
+            else:
+                items = ((item_path, False) for item_path in components["indexer"].index(path))
+            items = self.stats.timed("stage.indexer", items)
+        items = ((item_path, unchanged and item_path in old_by_path) for item_path,unchanged in items)
+        reused = 0
+        last_progress = start
+        for item_path,extracted in self._extract_items(components, items, workers):
+            if extracted is None:
+                entry = old_by_path[item_path]
+                reused = reused + 1
+            else:
+                entry = self._make_entry(extracted, old_by_path.get(item_path))
+            logging.debug("entry: %s", entry)
+            entries.append(entry)
+            if progress and time.time() - last_progress >= _PROGRESS_INTERVAL:
+                progress(list(entries))
+                last_progress = time.time()
+        if self.extraction_cache:
+            self.extraction_cache.commit()
+        elapsed = time.time() - start
+        logging.info("indexed %d items in %s in %.1fs (%.1f items/s, %d workers, %d reused)" % (len(entries), path, elapsed, len(entries) / elapsed if elapsed else 0, workers, reused))
         return entries
 
+    def _make_walk_entries(self, walk, old=False, progress=None):
+        """
+        makes the entries of each of the mounts in `walk`, which share one walk of their source,
+        returning a list of the entries per mount.
+        if `old` is set, the entries of the mounts in the current snapshot are reused where possible
+        if `progress` is set, it is called with the mount and a copy of its entries made so far, see `_make_entries`
+        """
+        start = time.time()
+        shared = self._walk_items(walk) if len(walk) > 1 else [None]
+        out = []
+        for mount,items in zip(walk, shared):
+            config = self.mount_configurations[mount]
+            old_entries = self.snapshot.index(mount).entries if old else None
+            mount_progress = (lambda entries, mount=mount: progress(mount, entries)) if progress else None
+            out.append(self._make_entries(config["components"], config["source"], old_entries, config["workers"], config["tracker"], mount_progress, items))
+        # the mounts of a shared walk are indexed together, so each took as long as all of them
+        for mount in walk:
+            self.mount_configurations[mount]["last_duration"] = time.time() - start
+        return out
+
+    def _walk_items(self, walk):
+        """
+        walks the source of the mounts in `walk` once, feeding each directory to each mount's indexer,
+        and returns a list of the (item_path, unchanged) pairs found, per mount
+        """
+        start = time.time()
+        configs = [self.mount_configurations[mount] for mount in walk]
+        source = configs[0]["source"]
+        indexers = [config["components"]["indexer"] for config in configs]
+        tracker = configs[0]["tracker"]
+        items = [[] for _ in walk]
+        if tracker:
+            walked = tracker.walk(indexers, source)
+        else:
+            walked = ((dir_items, False) for dir_items in walk_items(indexers, source))
+        for dir_items,unchanged in walked:
+            for mount_items,found in zip(items, dir_items):
+                mount_items.extend((item_path, unchanged) for item_path in found)
+        self.stats.add_time("stage.indexer", time.time() - start)
+        logging.info("walked %s once for %d mounts" % (source, len(walk)))
+        return items
+
+    def _commit_walk(self, walk):
+        """
+        has the tracker of the mounts in `walk`, if they are incremental, remember their last walk,
+        once the entries made from it are published; see `DirectoryTracker.commit`
+        """
+        tracker = self.mount_configurations[walk[0]]["tracker"]
+        if tracker:
+            tracker.commit()
+
+    def _extract_items(self, components, items, workers=1):
+        """
+        takes an iterable of (item_path, reuse) pairs and yields a pair of (item_path, extracted) for each
+        in the same order, where `extracted` is the output of `_extract_item`, or None if `reuse` was set.
+        with more than one worker, items are extracted by a thread pool in bounded batches, the next
+        batch being extracted while the previous one is consumed; entries must still be made
+        (and names disambiguated) in a single pass in item order.
+        """
+        extract = lambda item_path: self._extract_item(item_path, components)
+        if workers <= 1:
+            for item_path,reuse in items:
+                yield item_path, (None if reuse else extract(item_path))
+            return
+        items = iter(items)
+        batch_size = workers * _EXTRACT_CHUNKSIZE * _EXTRACT_BATCH_CHUNKS
+        pool = ThreadPool(workers)
+        try:
+            pending = None
+            while True:
+                batch = list(itertools.islice(items, batch_size))
+                if batch:
+                    extracting = pool.map_async(extract, [item_path for item_path,reuse in batch if not reuse], _EXTRACT_CHUNKSIZE)
+                if pending:
+                    pending_batch,pending_extracting = pending
+                    extracted = iter(pending_extracting.get())
+                    for item_path,reuse in pending_batch:
+                        yield item_path, (None if reuse else next(extracted))
+                if not batch:
+                    break
+                pending = (batch, extracting)
+        finally:
+            pool.close()
+            pool.join()
+
     #
     # Initialization
     #
 
     def fsinit(self):
+        # threads don't survive fuse daemonizing, so they are only started here
+        if int(self.config["background"]):
+            indexer = threading.Thread(target=self._index_in_background, name="index")
+            indexer.daemon = True
+            indexer.start()
+        if self.refresh:
+            refresher = threading.Thread(target=self._refresh_loop, name="refresh")
+            refresher.daemon = True
+            refresher.start()
+        watched = set()
+        for _,config in sorted(self.mount_configurations.items()):
+            if config["watch"] and config["source"] not in watched:
+                watcher = watch.SourceWatcher(config["source"], self._reindex, config["watchdelay"], config["watchmaxdelay"], self._watch_failed)
+                watcher.start()
+                self.watchers.append(watcher)
+                watched.add(config["source"])
         logging.debug("initialized filesystem")
 
+    def fsdestroy(self):
+        self._stopping.set()
+        for watcher in self.watchers:
+            watcher.stop()
+        logging.debug("destroyed filesystem")
+
     def configure(self):
         config = self._get_config_from_file() if self.cmdline[0].config else self._get_config_from_options()
         self.config.update(config)
         self.config = self._normalize_config_paths(self.config)
         self._configure_logging()
+        self.cache = LRUCache(self.config["cachesize"], self.config["expire"])
+        self.states = LRUCache(self.config["cachesize"], self.config["expire"]) # query states by path, of the current snapshot only
+        if self.config["extractcache"] != "off":
+            self.extraction_cache = ExtractionCache(self.config["extractcache"])
 
         logging.debug("configuring filesystem...")
         self.plugins = self._load_plugins()
         self.plugin_components = self._find_plugin_components()
         self._create_mount_configurations()
+        self._configure_kernel_caching()
         logging.debug("configured filesystem")
 
+    def _configure_kernel_caching(self):
+        """
+        has the kernel use our inode numbers, and cache lookups, attributes and failed lookups for
+        the `_KERNEL_TIMEOUTS` seconds. unless set, they follow how soon a mount may change: for as long
+        as the shortest refresh interval, or `_STATIC_TIMEOUT` if no mount refreshes, while mounts which
+        are watched or indexed in the background change at any time, so keep libfuse's defaults.
+        """
+        self.fuse_args.add("use_ino")
+        timeout = None
+        configs = self.mount_configurations.values()
+        if not int(self.config["background"]) and not any(config["watch"] for config in configs):
+            refreshes = [config["refresh"] for config in configs if config["refresh"] > 0]
+            timeout = min(refreshes) if refreshes else _STATIC_TIMEOUT
+        for opt in _KERNEL_TIMEOUTS:
+            value = self.config.get(opt, timeout)
+            if value is not None:
+                self.fuse_args.add(opt, str(value))
+
     def _normalize_config_paths(self, config):
         """expand and normalize paths defined in configuration"""
         if "log" in config:
             config["log"] = self._normalize_path(config["log"])
+        if "extractcache" in config and config["extractcache"] != "off":
+            config["extractcache"] = self._normalize_path(config["extractcache"])
         if "mounts" in config:
             for mount in config["mounts"]:
                 mount["source"] = self._normalize_path(mount["source"])
@@ -381,10 +588,11 @@ class UrchinFS(TemplateFS):
         logging.debug("loading configuration from command line options")
         options = self.cmdline[0]
         config = {}
-        d = {k:v for k,v in vars(options).items() if v}
+        # 0 is meaningful for timeouts and the cache limits, so only those which are unset are dropped
+        d = {k:v for k,v in vars(options).items() if v or (k in _ZERO_OPTIONS and v is not None)}
         # all options except these are part of the single mount configuration
         # which can be specified on the command line/in the fstab
-        nonmount = ["loglevel", "log", "expire", "plugindir"]
+        nonmount = ["loglevel", "log", "expire", "cachesize", "extractcache", "multithreaded", "background", "plugindir"] + _KERNEL_TIMEOUTS
         for opt in nonmount:
             if opt in d:
                 config[opt] = d[opt]
@@ -412,32 +620,224 @@ class UrchinFS(TemplateFS):
         return config
 
     def _create_mount_configurations(self):
-        for mount_options in self.config["mounts"]:
+        """
+        configures the mounts, numbered in configuration order, and indexes them unless indexing in the background.
+        mounts over the same source whose indexers walk it with the same options share a single walk
+        """
+        background = bool(int(self.config["background"]))
+        walks = {}
+        trackers = {}
+        for mount,mount_options in enumerate(self.config["mounts"]):
             components = self._configure_components(mount_options)
             logging.debug("components: %s" % pprint.pformat(components))
-            entries = self._make_entries(components, mount_options["source"])
+            source = mount_options["source"]
+            workers = int(mount_options.get("workers", 1))
+            indexer = components["indexer"]
+            incremental = bool(int(mount_options.get("incremental", 0)))
+            if incremental and not isinstance(indexer, AbstractWalkingIndexer):
+                raise ConfigurationError("The '%s' indexer does not support incremental refresh" % indexer.name)
+            walk = [mount]
+            tracker = None
+            if isinstance(indexer, AbstractWalkingIndexer):
+                walk_key = (source, indexer.prune.pattern if indexer.prune else None, indexer.maxdepth, incremental)
+                walk = walks.setdefault(walk_key, [])
+                walk.append(mount)
+                if incremental:
+                    tracker = trackers.setdefault(walk_key, DirectoryTracker())
             refresh = 0
             if "refresh" in mount_options:
                 refresh = mount_options["refresh"]
             if refresh > 0:
                 self.refresh = True # set if any mount config will refresh
-            self.mount_configurations[mount_options["source"]] = {
+            watch_source = bool(int(mount_options.get("watch", 0)))
+            if watch_source and not watch.available():
+                raise ConfigurationError("Watching '%s' requires the inotify package" % source)
+            self.mount_configurations[mount] = {
+                    "source": source,
                     "config": mount_options,
                     "components": components,
-                    "entries": entries,
                     "refresh": refresh,
+                    "workers": workers,
+                    "tracker": tracker,
+                    "walk": walk, # the mounts sharing a walk with this one, including it
+                    "watch": watch_source,
+                    "watchdelay": float(mount_options.get("watchdelay", 2)),
+                    "watchmaxdelay": float(mount_options.get("watchmaxdelay", 10)),
+                    "ready": not background,
+                    "error": None, # why the last index or refresh failed, if it did
                     "last_update": time.time(),
+                    "last_duration": None, # seconds the last full index or refresh took
                     }
+        mounts = sorted(self.mount_configurations.keys())
+        self.snapshot = Snapshot(0, tuple((mount, FacetIndex([])) for mount in mounts))
+        if not background:
+            indexes = {}
+            for walk in self._walks():
+                for mount,entries in zip(walk, self._make_walk_entries(walk)):
+                    indexes[mount] = FacetIndex(entries)
+                self._commit_walk(walk)
+            self.snapshot = Snapshot(0, tuple((mount, indexes[mount]) for mount in mounts))
+
+    def _walks(self):
+        """the groups of mounts which share a walk, in mount order"""
+        walks = []
+        for _,config in sorted(self.mount_configurations.items()):
+            if config["walk"] not in walks:
+                walks.append(config["walk"])
+        return walks
+
+    #
+    # Updates
+    #
+    # updates build new entries and a new index for a mount off the request path and then swap
+    # in a new snapshot; lookups in progress keep using the snapshot they started with.
+    # `_update_lock` serializes updates. lookups take no lock while they compute, but `_lock`
+    # makes the swap and its invalidation atomic with respect to lookups storing their results.
+    #
+
+    def _index_in_background(self):
+        """
+        runs in the background after mounting, indexing each mount and publishing the entries made so far as it goes.
+        a mount whose indexing fails keeps the entries published so far, is reported as failed, and is
+        indexed again once its refresh interval passes, if it refreshes
+        """
+        for walk in self._walks():
+            source = self.mount_configurations[walk[0]]["source"]
+            error = None
+            with self._update_lock:
+                logging.info("indexing %s in the background" % source)
+                try:
+                    for mount,entries in zip(walk, self._make_walk_entries(walk, progress=self._publish)):
+                        self._publish(mount, entries)
+                    self._commit_walk(walk)
+                except Exception, e:
+                    logging.exception("failed to index %s" % source)
+                    error = str(e) or type(e).__name__
+                for mount in walk:
+                    self.mount_configurations[mount]["ready"] = True
+                    self.mount_configurations[mount]["error"] = error
+                    self.mount_configurations[mount]["last_update"] = time.time()
+
+    def _refresh_loop(self):
+        """runs in the background, refreshing each mount once its refresh interval has passed"""
+        while not self._stopping.is_set():
+            try:
+                self._refresh()
+            except Exception:
+                logging.exception("failed to refresh")
+            now = time.time()
+            due = [config["last_update"] + config["refresh"] - now for config in self.mount_configurations.values() if config["refresh"] > 0]
+            self._stopping.wait(max(min(due), _MIN_REFRESH_WAIT))
 
     def _refresh(self):
-        refresh_time = time.time()
-        for source,config in self.mount_configurations.items():
-            if config["refresh"] > 0:
-                if refresh_time - config["last_update"] > config["refresh"]:
-                    logging.debug("refreshing %s" % source)
-                    config["last_update"] = refresh_time
-                    config["entries"] = self._make_entries(config["components"], source, config["entries"])
-                    self.cache_reset()
+        """refreshes the mounts whose refresh interval has passed, along with the mounts sharing their walk"""
+        refreshed = set()
+        for mount,config in sorted(self.mount_configurations.items()):
+            if config["refresh"] > 0 and config["ready"] and mount not in refreshed:
+                if time.time() - config["last_update"] > config["refresh"]:
+                    try:
+                        with self._update_lock:
+                            logging.debug("refreshing %s" % config["source"])
+                            for walk_mount,entries in zip(config["walk"], self._make_walk_entries(config["walk"], old=True)):
+                                self._publish(walk_mount, entries)
+                                self.mount_configurations[walk_mount]["last_update"] = time.time()
+                                self.mount_configurations[walk_mount]["error"] = None
+                            self._commit_walk(config["walk"])
+                    except Exception, e:
+                        # e.g. a file vanishing mid-refresh; keep what was indexed and try again next interval.
+                        # the walk isn't committed, so an incremental refresh lists the changed directories again
+                        logging.exception("failed to refresh %s, retrying in %ss" % (config["source"], config["refresh"]))
+                        for walk_mount in config["walk"]:
+                            self.mount_configurations[walk_mount]["last_update"] = time.time()
+                            self.mount_configurations[walk_mount]["error"] = str(e) or type(e).__name__
+                    refreshed.update(config["walk"])
+
+    def _reindex(self, source, directories):
+        """re-indexes the items below `directories` for the mounts of `source` which watch it, e.g. after they changed on disk"""
+        for mount,config in sorted(self.mount_configurations.items()):
+            if config["source"] != source or not config["watch"]:
+                continue
+            components = config["components"]
+            indexer = components["indexer"]
+            if isinstance(indexer, AbstractWalkingIndexer):
+                # the whole source is watched, so leave out what a walk of it would prune or not reach
+                index = lambda directory: indexer.index_below(source, directory)
+            else:
+                index = indexer.index
+            with self._update_lock:
+                extracted = [self._extract_item(item_path, components)
+                        for directory in directories for item_path in index(directory)]
+                if self.extraction_cache:
+                    self.extraction_cache.commit()
+                below = set(directories)
+                old_entries = self.snapshot.index(mount).entries
+                old_by_path = {entry.path: entry for entry in old_entries}
+                entries = [entry for entry in old_entries if not self._is_below(entry.path, below)]
+                entries.extend([self._make_entry(item, old_by_path.get(item[0])) for item in extracted])
+                self._publish(mount, entries)
+            logging.info("re-indexed %d items below %s" % (len(extracted), ", ".join(directories)))
+
+    def _watch_failed(self, source, e):
+        """records why watching `source` failed in the mounts which watch it, so `.urchin-status` reports them as failed"""
+        for config in self.mount_configurations.values():
+            if config["source"] == source and config["watch"]:
+                config["error"] = "not watching: %s" % (str(e) or type(e).__name__)
+
+    def _publish(self, mount, entries):
+        """
+        swaps in a new snapshot in which `mount` has `entries`. only called under `_update_lock`,
+        so the snapshot can't change meanwhile and the entries which changed are found before taking
+        `_lock`, which lookups wait for to store their results
+        """
+        index = FacetIndex(entries)
+        changed = self._changed_entries(self.snapshot.index(mount).entries, entries)
+        with self._lock:
+            self.snapshot = self.snapshot.replace(mount, index)
+            self._invalidate(changed)
+            # states hold the indexes they were resolved against, so would keep the old index alive
+            self.states.clear()
+        logging.debug("published snapshot %d" % self.snapshot.generation)
+
+    def _is_below(self, path, directories):
+        """true if `path` is one of, or is below one of, the set of `directories`"""
+        while path not in directories:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return False
+            path = parent
+        return True
+
+    def _changed_entries(self, old_entries, new_entries):
+        """returns the entries which were added, removed or altered, in both their old and new versions"""
+        old_by_path = {entry.path: entry for entry in old_entries}
+        new_by_path = {entry.path: entry for entry in new_entries}
+        changed = [entry for path,entry in old_by_path.iteritems() if path not in new_by_path]
+        for path,entry in new_by_path.iteritems():
+            old_entry = old_by_path.get(path)
+            if old_entry is None:
+                changed.append(entry)
+            elif old_entry.metadata != entry.metadata or old_entry.name_tuples != entry.name_tuples:
+                changed.append(old_entry)
+                changed.append(entry)
+        return changed
+
+    def _invalidate(self, changed):
+        """
+        evicts the cached paths whose listing could include any of the `changed` entries,
+        i.e. those whose facets the entry matches
+        """
+        if not changed:
+            return
+        evicted = 0
+        for key in self.cache.keys():
+            _,parts = key
+            facets = {self.dictionary.lookup(k): set([self.dictionary.lookup(v) for v in values]) for k,values in _path_facets(parts).iteritems()}
+            for entry in changed:
+                if all(not values.isdisjoint(entry.metadata.get(k, ())) for k,values in facets.iteritems()):
+                    self.cache.pop(key)
+                    evicted = evicted + 1
+                    break
+        logging.debug("%d changed entries evicted %d cached paths" % (len(changed), evicted))
 
     #
     # util
@@ -471,119 +871,154 @@ class UrchinFS(TemplateFS):
     # Lookups
     #
 
+    # lookups may run concurrently with each other and with updates. each reads the snapshot
+    # which is current when it starts, and only shares the (thread-safe) cache with others.
+
     def _get_results(self, path):
-        if self.refresh:
-            self._refresh()
         parts = self._strip_empty_prefix(self._split_path(path))
-        return self._get_results_from_parts(parts)
+        return self._get_results_from_parts(self.snapshot, tuple(parts))
+
+    @cache
+    def _get_results_from_parts(self, snapshot, parts):
+        return self._get_query_state(snapshot, parts).results()
+
+    @cache
+    def _get_listing_from_parts(self, snapshot, parts):
+        """the names of the results for the path `parts`, encoded for readdir, which lists them from an offset into them"""
+        return tuple([r.name.encode('utf_8', 'replace') for r in self._get_results_from_parts(snapshot, parts)])
 
     @cache
-    def _get_results_from_parts(self, parts):
-        if not parts: # root dir
-            return [result for configuration in self.mount_configurations.values() for entry in configuration["entries"] for result in entry.results] + [_AND_RESULT, _CUR_RESULT, _PARENT_RESULT]
-
-        # fake enum
-        class Parsed:
-            KEY, VAL, AND, OR, NONE, DIR = range(1,7)
-
-        found = [entry for configuration in self.mount_configurations.values() for entry in configuration["entries"]]
-        current_valid_keys = set([key for entry in found for key in entry.metadata.keys()])
-        current_valid_values = set()
-        current_key = None
-        state = dict()
-
-        last = Parsed.NONE
-        last_index = len(parts)-1
-
-        for index,part in enumerate(parts):
-            is_last = index == last_index
-
-            if part == _AND:
-                last = Parsed.AND
-                current_key = None
-                current_valid_values = set()
-                current_valid_keys = set([key for key in entry.metadata.keys() for entry in found]) - set(state.keys())
-                if is_last:
-                    return [Result(key) for key in current_valid_keys] + [_CUR_RESULT, _PARENT_RESULT]
-            elif last == Parsed.AND:
-                last = Parsed.KEY
-                if part not in current_valid_keys:
-                    raise InvalidPathError("invalid key [%s]" % part)
-                if part in state:
-                    raise InvalidPathError("duplicate key [%s]" % part)
-                current_key = part
-                current_valid_keys = current_valid_keys - set([current_key])
-                state[current_key] = set()
-                current_valid_values = set([v for f in found for k,values in f.metadata.iteritems() for v in values if k == current_key])
-                if is_last:
-                    return [Result(value) for value in current_valid_values] + [_CUR_RESULT, _PARENT_RESULT]
-            elif last == Parsed.VAL and part == _OR:
-                last = Parsed.OR
-                if is_last:
-                    return [Result(value) for value in current_valid_values] + [_CUR_RESULT, _PARENT_RESULT]
-            elif last == Parsed.KEY or last == Parsed.OR:
-                last = Parsed.VAL
-                if part not in current_valid_values:
-                    logging.debug("current_valid_values: %s" % ','.join(current_valid_values))
-                    raise InvalidPathError("invalid value [%s]" % part)
-                current_valid_values = current_valid_values - set([part])
-                state[current_key].add(part)
-                # lookahead, and if the next token is _not_ an OR,
-                # filter the entries by the current facet
-                if is_last or (not is_last and parts[index+1] != _OR):
-                    newfound = []
-                    logging.debug("finding %s -> %s" % (current_key, state[current_key]))
-                    for e in found:
-                        keep = False
-                        logging.debug("\ttesting %s" % e.path)
-                        if current_key in e.metadata:
-                            logging.debug("\t\tkey %s exists" % current_key)
-                            for v in state[current_key]:
-                                if v in e.metadata[current_key]:
-                                    logging.debug("\t\tvalue %s exists" % v)
-                                    keep = True
-                        if keep:
-                            newfound.append(e)
-                    found = newfound
-                if is_last:
-                    ret = [r for f in found for r in f.results] + [_CUR_RESULT, _PARENT_RESULT]
-                    # add AND and OR if appropriate
-                    if len(current_valid_values) > 0:
-                        ret = ret + [_OR_RESULT]
-                    if len(current_valid_keys) > 0:
-                        ret = ret + [_AND_RESULT]
-                    return ret
+    def _get_facets_from_parts(self, snapshot, parts):
+        """the content of the facet summary of the directory at the path `parts`, see `_QueryState.facet_counts`"""
+        return json_dumps(self._get_query_state(snapshot, parts).facet_counts(), sort_keys=True) + "\n"
+
+    @cache
+    def _get_stat_from_parts(self, snapshot, parts):
+        """the `Stat` of the path `parts`, numbered by `_inode`, or None if the path has no `.` result"""
+        for r in self._get_results_from_parts(snapshot, parts):
+            if r.name == _CUR:
+                return snapshot.stat(r, _inode(parts))
+        return None
+
+    def _get_query_state(self, snapshot, parts):
+        """
+        returns the parsed query state for the path `parts`
+
+        states are cached by path prefix in `states`, and since lookups arrive parent-first,
+        a path is resolved with a single step from the state of its parent.
+        unlike the listings in `cache`, they are dropped whenever a snapshot is published.
+        """
+        state = self.states.get(parts)
+        if state is None:
+            if not parts: # root dir
+                state = _QueryState.root([mount_index for _,mount_index in snapshot.mounts], self.dictionary)
+            else:
+                state = self._get_query_state(snapshot, parts[:-1]).step(parts[-1])
+            self._cache_put(snapshot, parts, state, self.states)
+        return state
+
+    def _virtual_file_content(self, parts):
+        """returns the content of the virtual file at the path `parts`"""
+        if parts == (_STATUS,):
+            return self._status()
+        if parts == (_STATS,):
+            return self._stats()
+        snapshot = self.snapshot
+        state = self._get_query_state(snapshot, parts) # only where it is listed
+        if state.entry is not None:
+            return json_dumps(self._entry_metadata(state.entry), sort_keys=True) + "\n"
+        if parts and parts[-1] == _FACETS:
+            return self._get_facets_from_parts(snapshot, parts[:-1])
+        raise InvalidPathError("no virtual file [%s]" % "/".join(parts))
+
+    def _status(self):
+        """
+        the indexing status: a first line which is "indexing" until every mount has been indexed,
+        then "failed" if indexing or the last refresh of any mount failed and "ready" otherwise,
+        followed by the state and number of items of each mount.
+        built as unicode, since sources and errors may hold any bytes
+        """
+        lines = []
+        for mount,mount_index in self.snapshot.mounts:
+            config = self.mount_configurations[mount]
+            if not config["ready"]:
+                state = "indexing"
+            elif config["error"]:
+                state = u"failed (%s)" % _text(config["error"])
             else:
-                last = Parsed.DIR
-                # a "normal directory", i.e. something somewhere else on disk
-                # if this isn't the last component in the path, error out
-                if not is_last:
-                    raise InvalidPathError("woops")
-                for f in found:
-                    for r in f.results:
-                        if r.name == part:
-                            return [Result(_CUR, r.destination)]
-                raise InvalidPathError("invalid dir name [%s]" % part)
+                state = "ready"
+            lines.append(u"%s: %s, %d items" % (_text(config["source"]), state, len(mount_index.entries)))
+        configs = self.mount_configurations.values()
+        if not all(config["ready"] for config in configs):
+            status = "indexing"
+        elif any(config["error"] for config in configs):
+            status = "failed"
+        else:
+            status = "ready"
+        return "\n".join([status] + lines) + "\n"
+
+    def _stats(self):
+        """
+        the live counters and timings, a "name value" line each: of the path cache and of the
+        cache of parsed paths (`states`), each counting only its own lookups, of each mount,
+        of the time spent in each stage of indexing since mounting, and of the calls of each operation.
+        built as unicode, since sources may hold any bytes
+        """
+        counts,times = self.stats.copy()
+        lines = [
+                "cache.paths %d" % len(self.cache),
+                "cache.hits %d" % self.cache.hits,
+                "cache.misses %d" % self.cache.misses,
+                "cache.evictions %d" % self.cache.evictions,
+                "cache.expirations %d" % self.cache.expirations,
+                "states.paths %d" % len(self.states),
+                "states.hits %d" % self.states.hits,
+                "states.misses %d" % self.states.misses,
+                "snapshot.generation %d" % self.snapshot.generation,
+                "dictionary.strings %d" % len(self.dictionary),
+                ]
+        if self.extraction_cache:
+            lines.append("extractcache.hits %d" % self.extraction_cache.hits)
+            lines.append("extractcache.misses %d" % self.extraction_cache.misses)
+        for mount,mount_index in self.snapshot.mounts:
+            config = self.mount_configurations[mount]
+            lines.append(u"mount.%d.source %s" % (mount, _text(config["source"])))
+            lines.append("mount.%d.entries %d" % (mount, len(mount_index.entries)))
+            if config["last_duration"] is not None:
+                lines.append("mount.%d.last_refresh_seconds %.3f" % (mount, config["last_duration"]))
+        lines.extend(["%s_seconds %.3f" % (name, seconds) for name,seconds in sorted(times.items())])
+        lines.extend(["%s %d" % (name, n) for name,n in sorted(counts.items())])
+        return "\n".join(lines) + "\n"
+
+    def _cache_put(self, snapshot, key, value, cache=None):
+        """
+        caches `value`, computed from `snapshot`, in `cache` (default: the path cache) unless another
+        snapshot was published meanwhile; its invalidation may already have run, so the value could
+        otherwise outlive its entries
+        """
+        with self._lock:
+            if self.snapshot is snapshot:
+                (self.cache if cache is None else cache).put(key, value)
 
     #
     # Fuse handling
     #
 
+    @counted
     def getattr(self, path):
         path = path.decode('utf_8')
         logging.debug("getattr: %s" % path)
         try:
-            results = self._get_results(path)
-            logging.debug("\t%s" % results)
-            for r in results:
-                if r.name == _CUR:
-                    result_stat = Stat(st_mode = r.mode, st_size = r.size)
-                    logging.debug("\t%s" % result_stat)
-                    return result_stat
+            parts = self._strip_empty_prefix(self._split_path(path))
+            result_stat = self._get_stat_from_parts(self.snapshot, tuple(parts))
+            logging.debug("\t%s" % result_stat)
+            if result_stat is not None:
+                return result_stat
         except InvalidPathError,e:
             pass
         return -errno.ENOENT
 
+    @counted
     def access(self, path, flags):
         path = path.decode('utf_8')
         logging.debug("access: %s (flags %s)" % (path, oct(flags)))
@@ -598,6 +1033,7 @@ class UrchinFS(TemplateFS):
             pass
         return -errno.ENOENT
 
+    @counted
     def opendir(self, path):
         path = path.decode('utf_8')
         logging.debug("opendir: %s" % path)
@@ -609,18 +1045,46 @@ class UrchinFS(TemplateFS):
             pass
         return -errno.ENOENT
 
+    @counted
     def readdir(self, path, offset, dh=None):
         path = path.decode('utf_8')
         logging.debug("readdir: %s (offset %s, dh %s)" % (path, offset, dh))
         try:
-            results = self._get_results(path)
-            logging.debug("\t%s" % results)
-            for result in results:
-                logging.debug("\tyeilding %s" % result)
-                yield fuse.Direntry(result.name.encode('utf_8', 'replace'))
+            parts = self._strip_empty_prefix(self._split_path(path))
+            names = self._get_listing_from_parts(self.snapshot, tuple(parts))
+            logging.debug("\t%d names" % len(names))
+            # each name carries the offset of the next, from which the kernel asks for the rest
+            # once its buffer is full, so a large listing is read a page at a time
+            for i in xrange(offset, len(names)):
+                yield fuse.Direntry(names[i], offset=i + 1)
         except InvalidPathError:
             logging.debug("readdir: invalid path %s" % path)
 
+    @counted
+    def open(self, path, flags):
+        path = path.decode('utf_8')
+        logging.debug("open: %s (flags %s)" % (path, oct(flags)))
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            return -errno.EACCES
+        try:
+            parts = tuple(self._strip_empty_prefix(self._split_path(path)))
+            return VirtualFile(self._virtual_file_content(parts).encode('utf_8', 'replace'))
+        except InvalidPathError:
+            pass
+        return -errno.ENOENT
+
+    @counted
+    def read(self, path, size, offset, fh=None):
+        logging.debug("read: %s (size %s, offset %s)" % (path, size, offset))
+        if not isinstance(fh, VirtualFile):
+            return -errno.EBADF
+        return fh.content[offset:offset + size]
+
+    @counted
+    def release(self, path, flags, fh=None):
+        logging.debug("release: %s" % path)
+
+    @counted
     def readlink(self, path):
         # TODO it seems like FUSE-python might be calling this too often... see the logs in debugging mode.
         path = path.decode('utf_8')
@@ -635,6 +1099,53 @@ class UrchinFS(TemplateFS):
             pass
         return -errno.ENOENT
 
+    @counted
+    def getxattr(self, path, name, size):
+        path = path.decode('utf_8')
+        logging.debug("getxattr: %s (name %s, size %s)" % (path, name, size))
+        try:
+            xattrs = self._get_xattrs(path)
+        except InvalidPathError:
+            return -errno.ENOENT
+        if name not in xattrs:
+            return -errno.ENODATA
+        value = xattrs[name]
+        if size == 0:
+            # asked for the size of the value
+            return len(value)
+        return value
+
+    @counted
+    def listxattr(self, path, size):
+        path = path.decode('utf_8')
+        logging.debug("listxattr: %s (size %s)" % (path, size))
+        try:
+            names = sorted(self._get_xattrs(path).keys())
+        except InvalidPathError:
+            return -errno.ENOENT
+        if size == 0:
+            # asked for the size of the names, each followed by a null byte
+            return len("".join(names)) + len(names)
+        return names
+
+    def _get_xattrs(self, path):
+        """
+        the extended attributes of `path`, encoded: for a file of a `.urchin-metadata` directory, one named
+        `_XATTR_PREFIX` + key per key of its entry's metadata, holding its values a line each; none otherwise.
+        they are not put on the symlinks themselves, since Linux only lets user attributes of regular
+        files and directories be read.
+        """
+        parts = self._strip_empty_prefix(self._split_path(path))
+        entry = self._get_query_state(self.snapshot, tuple(parts)).entry
+        if entry is None:
+            return {}
+        return {(_XATTR_PREFIX + key).encode('utf_8', 'replace'): u"\n".join(values).encode('utf_8', 'replace')
+                for key,values in self._entry_metadata(entry).iteritems()}
+
+    def _entry_metadata(self, entry):
+        """the metadata of `entry`, decoded, mapping each key to its sorted values"""
+        return {key: sorted(values) for key,values in self.dictionary.decode_metadata(entry.metadata).iteritems()}
+
 class ConfigurationError(fuse.FuseError):
     pass
 
@@ -666,63 +1177,286 @@ class _immutable(type):
         cls.__setattr__ = setattr
         cls.__delattr__ = delattr
 
-class Entry(object):
+class Entry(tuple):
     """
-    An entry in the filesystem.
+    An entry in the filesystem; immutable.
     `path` is the actual path of the file/directory
-    `metadata_paths` are the paths from which `metadata` is derived
-    `metadata` is the metadata associated with the entry
-    `name_tuples` is a list of tuples of (name, disambiguation_number); the names by which the entry will be displayed
+    `metadata_paths` is a tuple of the paths from which `metadata` is derived
+    `metadata` is the metadata associated with the entry, encoded by a `Dictionary`
+    `name_tuples` is a tuple of tuples of (name, disambiguation_number); the names by which the entry will be displayed
+    `results` is a tuple of the `Result`s by which the entry is listed, one per name
+
+    Entries are kept for every item of every mount, so they are tuples without an instance dict.
+    Like other objects, they compare and hash by identity.
     """
-    __metaclass__ = _immutable
-    def __init__(self, path, metadata_paths, metadata, name_tuples):
+    __slots__ = ()
+    def __new__(cls, path, metadata_paths, metadata, name_tuples):
         assert type(path) == str
-        self.path = path
-        assert type(metadata_paths) == set
-        self.metadata_paths = metadata_paths
-        assert type(metadata) == dict
-        self.metadata = metadata
-        assert type(name_tuples) == list
+        assert type(metadata_paths) in (set, frozenset, tuple)
+        assert isinstance(metadata, Metadata)
+        assert type(name_tuples) in (list, tuple)
         if name_tuples:
             assert type(name_tuples[0]) == tuple
-        self.name_tuples = name_tuples
-        self.results = [Result("%s (%s)" % (name, idx) if idx != 0 else name, self.path) for name,idx in self.name_tuples]
-    # TODO evaluate if we should make an inverted hash
-    #def __hash__(self):
-    #    # TODO should this take into account the metadata values?
-    #    return hash((self.path,)
-    #           + tuple(self.metadata_paths)
-    #           + tuple(self.name_tuples)
-    #           + tuple(self.metadata.keys()))
+        name_tuples = tuple(name_tuples)
+        results = tuple(Result("%s (%s)" % (name, idx) if idx != 0 else name, path) for name,idx in name_tuples)
+        return tuple.__new__(cls, (path, tuple(metadata_paths), metadata, name_tuples, results))
+    path = property(operator.itemgetter(0))
+    metadata_paths = property(operator.itemgetter(1))
+    metadata = property(operator.itemgetter(2))
+    name_tuples = property(operator.itemgetter(3))
+    results = property(operator.itemgetter(4))
+    __hash__ = object.__hash__
+    def __eq__(self, other):
+        return self is other
+    def __ne__(self, other):
+        return self is not other
     def __repr__(self):
         return "<Entry %s -> %s>" % (self.path, "[%s]" % ",".join(["%s (%s)" % (name, idx) if idx != 0 else name for name,idx in self.name_tuples]))
 
-class Result(object):
-    """representation of a directory/symlink"""
-    def __init__(self, name, destination=None):
-        self.name = name
-        self.destination = destination
-        self.mode = (stat.S_IFLNK | 0777) if self.destination else (stat.S_IFDIR | 0755)
+class Snapshot(object):
+    """
+    The indexed state of every mount at one point in time.
+    `generation` counts the snapshots swapped in since mounting
+    `mounts` is a tuple of (mount number, FacetIndex) pairs, in mount order
+    `stats` maps the (mode, size) of the results which getattr reports to their `Stat`,
+    made once when the snapshot is made, so every getattr against it copies them
+    """
+    __metaclass__ = _immutable
+    def __init__(self, generation, mounts):
+        self.generation = generation
+        self.mounts = mounts
+        now = datetime.datetime.utcnow()
+        self.stats = {(r.mode, r.size): Stat(st_mode=r.mode, st_size=r.size, dt_atime=now, dt_mtime=now, dt_ctime=now)
+                for r in _STAT_RESULTS}
+    def stat(self, result, ino=0):
+        """a `Stat` of `result` with the inode number `ino`"""
+        template = self.stats.get((result.mode, result.size))
+        if template is None:
+            result_stat = Stat(st_mode=result.mode, st_size=result.size)
+        else:
+            result_stat = copy.copy(template)
+        result_stat.st_ino = ino
+        return result_stat
+    def index(self, mount):
+        for number,mount_index in self.mounts:
+            if number == mount:
+                return mount_index
+        raise KeyError(mount)
+    def replace(self, mount, index):
+        """returns the next snapshot, in which `mount` has `index`"""
+        return Snapshot(self.generation + 1, tuple((number, index if number == mount else mount_index) for number,mount_index in self.mounts))
+    def __repr__(self):
+        return "<Snapshot %d>" % self.generation
+
+_LINK_MODE = stat.S_IFLNK | 0777
+_DIR_MODE = stat.S_IFDIR | 0755
+_VIRTUAL_FILE_MODE = stat.S_IFREG | 0444
+
+class Result(tuple):
+    """
+    representation of a directory/symlink, or of a read-only virtual file if `virtual` is set; immutable.
+    a tuple of (name, destination, mode), since every entry keeps one per name
+    """
+    __slots__ = ()
+    def __new__(cls, name, destination=None, virtual=False):
+        if virtual:
+            mode = _VIRTUAL_FILE_MODE
+        else:
+            mode = _LINK_MODE if destination else _DIR_MODE
+        return tuple.__new__(cls, (name, destination, mode))
+    name = property(operator.itemgetter(0))
+    destination = property(operator.itemgetter(1))
+    mode = property(operator.itemgetter(2))
+    @property
+    def size(self):
+        if self.mode == _VIRTUAL_FILE_MODE:
+            # the content is generated when the file is opened, see `VirtualFile`
+            return 0
         # "The size of a symbolic link is the length of the
         # pathname it contains, without a terminating null byte."
-        self.size = len(name) if self.destination else Stat.DIRSIZE
+        return len(self.name) if self.destination else Stat.DIRSIZE
     def __repr__(self):
         return "<Result %s>" % (self.name.encode("utf-8") if self.destination is None else "%s -> %s" % (self.name.encode("utf-8"), self.destination))
 
+class VirtualFile(fuse.FuseFileInfo):
+    """
+    The handle of an open virtual file, holding the content rendered when it was opened.
+    Virtual files report a size of 0, so they are read with direct io, which ignores the size.
+    """
+    def __init__(self, content):
+        fuse.FuseFileInfo.__init__(self, direct_io=True, keep=False)
+        self.content = content
+
 _AND = u"^"
 _OR = u"+"
 _CUR = u"."
 _PARENT= u".."
+_STATUS = u".urchin-status"
+_STATS = u".urchin-stats"
+_XATTR_PREFIX = u"user.urchin."
+_FACETS = u".urchin-facets.json"
+_METADATA = u".urchin-metadata"
 
 _AND_RESULT = Result(_AND)
 _OR_RESULT = Result(_OR)
 _CUR_RESULT = Result(_CUR)
 _PARENT_RESULT = Result(_PARENT)
+_STATUS_RESULT = Result(_STATUS, virtual=True)
+_STATS_RESULT = Result(_STATS, virtual=True)
+_FACETS_RESULT = Result(_FACETS, virtual=True)
+_METADATA_RESULT = Result(_METADATA)
+
+# getattr reports the `.` result of a path, which is one of these
+_STAT_RESULTS = (_CUR_RESULT, Result(_CUR, "/"), Result(_CUR, virtual=True))
+
+def _text(s):
+    """`s` as unicode, decoding byte strings such as paths and error messages as utf-8, replacing what isn't"""
+    return s if isinstance(s, unicode) else s.decode('utf_8', 'replace')
+
+def _inode(parts):
+    """
+    the inode number of the path `parts`: a hash of the path, so the same path keeps its number
+    for as long as it exists, across snapshots, and different paths almost never share one
+    """
+    return hash(parts) & 0x7fffffffffffffff or 1
+
+def _path_facets(parts):
+    """
+    returns the facets (key -> set of values) by which the path `parts` filters its entries.
+    the last key is left out since the `+` listing below it also depends on entries
+    which its values do not match; this errs on the side of matching too much.
+    """
+    facets = {}
+    key = None
+    last = None
+    for part in parts:
+        if last == _AND:
+            key = part
+            facets[key] = set()
+        elif part != _AND and part != _OR and key is not None:
+            facets[key].add(part)
+        last = part
+    if key is not None:
+        del facets[key]
+    return facets
+
+class _QueryState(object):
+    """
+    The parsed state of a path in the facet tree; immutable.
+    `found` holds a (mount index, id set) pair per mount for the entries matching the path.
+    `base` holds the same before the values of the current `key` were applied.
+    `facets` maps each chosen key to the frozenset of its chosen values.
+    `leaf` is the `.` result of a path naming a symlink or file, and `entry` the entry a file of a
+    `.urchin-metadata` directory describes.
+    keys and values are held as the codes of `dictionary`, and only decoded for listings.
+    """
+    # fake enum
+    NONE, AND, KEY, VAL, OR, DIR, META = range(1,8)
+
+    def __init__(self, dictionary, last, found, base=(), facets=None, key=None, valid_keys=frozenset(), valid_values=frozenset(), leaf=None, entry=None):
+        self.dictionary = dictionary
+        self.last = last
+        self.found = found
+        self.base = base
+        self.facets = facets or {}
+        self.key = key
+        self.valid_keys = valid_keys
+        self.valid_values = valid_values
+        self.leaf = leaf
+        self.entry = entry
+
+    @classmethod
+    def root(cls, indexes, dictionary):
+        return cls(dictionary, cls.NONE, tuple((mount_index, mount_index.all) for mount_index in indexes))
+
+    def step(self, part):
+        """returns the state for the child `part` of this state's path"""
+        if self.last == self.DIR:
+            raise InvalidPathError("woops")
+        if part in (_STATUS, _STATS) and self.last == self.NONE:
+            return _QueryState(self.dictionary, self.DIR, (), leaf=Result(_CUR, virtual=True))
+        if part == _FACETS and self.last in (self.NONE, self.VAL):
+            return _QueryState(self.dictionary, self.DIR, (), leaf=Result(_CUR, virtual=True))
+        if part == _METADATA and self.last in (self.NONE, self.VAL):
+            return _QueryState(self.dictionary, self.META, self.found)
+        if part == _AND and self.last in (self.NONE, self.VAL):
+            keys = set([key for mount_index,ids in self.found for key in mount_index.keys(ids)])
+            return _QueryState(self.dictionary, self.AND, self.found, facets=self.facets, valid_keys=frozenset(keys) - frozenset(self.facets.keys()))
+        if self.last == self.AND:
+            key = self.dictionary.lookup(part)
+            if key not in self.valid_keys:
+                raise InvalidPathError("invalid key [%s]" % part)
+            values = set([value for mount_index,ids in self.found for value in mount_index.values(key, ids)])
+            return _QueryState(self.dictionary, self.KEY, self.found, self.found, self.facets, key, self.valid_keys - frozenset([key]), frozenset(values))
+        if self.last == self.VAL and part == _OR:
+            return _QueryState(self.dictionary, self.OR, self.base, self.base, self.facets, self.key, self.valid_keys, self.valid_values)
+        if self.last in (self.KEY, self.OR):
+            value = self.dictionary.lookup(part)
+            if value not in self.valid_values:
+                raise InvalidPathError("invalid value [%s]" % part)
+            facets = dict(self.facets)
+            facets[self.key] = facets.get(self.key, frozenset()) | frozenset([value])
+            found = tuple((mount_index, mount_index.match(self.key, facets[self.key], ids)) for mount_index,ids in self.base)
+            return _QueryState(self.dictionary, self.VAL, found, self.base, facets, self.key, self.valid_keys, self.valid_values - frozenset([value]))
+        # a "normal directory", i.e. something somewhere else on disk, or the metadata file of one
+        for mount_index,ids in self.found:
+            entry = mount_index.entry(part, ids)
+            if entry is not None:
+                if self.last == self.META:
+                    return _QueryState(self.dictionary, self.DIR, (), leaf=Result(_CUR, virtual=True), entry=entry)
+                return _QueryState(self.dictionary, self.DIR, (), leaf=Result(_CUR, entry.path))
+        raise InvalidPathError("invalid dir name [%s]" % part)
+
+    def facet_counts(self):
+        """
+        maps each key which may still be chosen below this state's `^` to its values among the
+        entries found, each with the number of those entries having it; decoded for display
+        """
+        keys = set([key for mount_index,ids in self.found for key in mount_index.keys(ids)]) - set(self.facets.keys())
+        summary = {}
+        for key in keys:
+            counts = summary.setdefault(self.dictionary.decode(key), {})
+            for mount_index,ids in self.found:
+                for value,n in mount_index.counts(key, ids).iteritems():
+                    value = self.dictionary.decode(value)
+                    counts[value] = counts.get(value, 0) + n
+        return summary
+
+    def results(self):
+        """the directory listing for this state"""
+        if self.last == self.DIR:
+            return [self.leaf]
+        if self.last == self.AND:
+            ret = [Result(self.dictionary.decode(key)) for key in self.valid_keys]
+            ret.extend([_CUR_RESULT, _PARENT_RESULT])
+            return ret
+        if self.last in (self.KEY, self.OR):
+            ret = [Result(self.dictionary.decode(value)) for value in self.valid_values]
+            ret.extend([_CUR_RESULT, _PARENT_RESULT])
+            return ret
+        # extended in place, since the entries' results may be a long list
+        ret = []
+        if self.last == self.META:
+            for mount_index,ids in self.found:
+                ret.extend([Result(r.name, virtual=True) for r in mount_index.results(ids)])
+            ret.extend([_CUR_RESULT, _PARENT_RESULT])
+            return ret
+        for mount_index,ids in self.found:
+            ret.extend(mount_index.results(ids))
+        if self.last == self.NONE:
+            ret.extend([_AND_RESULT, _CUR_RESULT, _PARENT_RESULT, _STATUS_RESULT, _STATS_RESULT, _FACETS_RESULT, _METADATA_RESULT])
+            return ret
+        ret.extend([_CUR_RESULT, _PARENT_RESULT, _FACETS_RESULT, _METADATA_RESULT])
+        # add AND and OR if appropriate
+        if len(self.valid_values) > 0:
+            ret.append(_OR_RESULT)
+        if len(self.valid_keys) > 0:
+            ret.append(_AND_RESULT)
+        return ret
 
 def main():
     server = UrchinFS(version="%prog " + __version__, dash_s_do='setsingle')
     args = server.parse(errex=1)
-    server.multithreaded = 0
     try:
         server.configure()
     except ConfigurationError, e:
@@ -730,6 +1464,8 @@ def main():
         logging.error(msg)
         sys.stderr.write(msg)
         sys.exit(1)
+    if not int(server.config["multithreaded"]):
+        server.multithreaded = 0
     try:
         server.main()
     except fuse.FuseError, e:
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+import re
+import logging
+import fnmatch
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+def glob_pattern(globs, exclude=()):
+    """
+    compiles the lists of globs `globs` and `exclude` into a single regex matching the names
+    which match any of `globs` but none of `exclude`, or returns None if `globs` is empty
+    """
+    if not globs:
+        return None
+    pattern = "|".join("(?:%s)" % fnmatch.translate(glob) for glob in globs)
+    if exclude:
+        pattern = "(?!%s)(?:%s)" % ("|".join("(?:%s)" % fnmatch.translate(glob) for glob in exclude), pattern)
+    return re.compile(pattern)
+
+def listdir(path, prune=None):
+    """
+    returns a tuple of the lists of the subdirectory paths and of the file names in the directory `path`.
+    like `os.walk`, links to directories are neither files nor subdirectories to descend into,
+    and subdirectories whose name matches the `glob_pattern` `prune` are left out.
+    uses `scandir`, when available, which avoids a stat per child on most filesystems
+    """
+    subdirectories = []
+    filenames = []
+    if scandir:
+        for child in scandir(path):
+            if not child.is_dir():
+                filenames.append(child.name)
+            elif not child.is_symlink() and not (prune and prune.match(child.name)):
+                subdirectories.append(child.path)
+        return subdirectories, filenames
+    for name in os.listdir(path):
+        child = os.path.join(path, name)
+        if not os.path.isdir(child):
+            filenames.append(name)
+        elif not os.path.islink(child) and not (prune and prune.match(name)):
+            subdirectories.append(child)
+    return subdirectories, filenames
+
+def walk(path, prune=None, maxdepth=0, depth=0):
+    """
+    yields a tuple of (dirpath, file names) for `path` and each directory below it, in `os.walk` order,
+    leaving out directories matching the `glob_pattern` `prune` and, unless `maxdepth` is 0,
+    directories more than `maxdepth` levels below the top of the walk, `path` being `depth` levels below it
+    """
+    stack = [(path, depth)]
+    while stack:
+        dirpath,depth = stack.pop()
+        try:
+            subdirectories,filenames = listdir(dirpath, prune)
+        except OSError:
+            continue
+        yield dirpath, filenames
+        if not maxdepth or depth < maxdepth:
+            stack.extend((subdirectory, depth + 1) for subdirectory in reversed(subdirectories))
+
+def walk_items(indexers, path):
+    """
+    walks `path` once for several `AbstractWalkingIndexer`s, yielding for each directory a tuple
+    of the list of items each indexer finds in it. the indexers must share their walk options
+    """
+    for dirpath,filenames in walk(path, indexers[0].prune, indexers[0].maxdepth):
+        yield tuple(indexer.index_directory(dirpath, filenames) for indexer in indexers)
+
+class DirectoryTracker(object):
+    """
+    Walks a tree for one or more `AbstractWalkingIndexer`s, remembering the mtime, subdirectories
+    and items of each directory so that directories whose mtime is unchanged aren't listed
+    or indexed again.
+
+    A directory's mtime only changes when entries are added, removed or renamed in it,
+    so files which are rewritten in place aren't noticed.
+
+    A walk's state is only remembered once `commit` is called, i.e. once the entries made from
+    the walk are in use, so a walk whose entries are thrown away is walked again.
+    """
+    def __init__(self):
+        self.directories = {} # path -> (mtime, subdirectory paths, tuple of items per indexer)
+        self.walked = None # the state of the last completed walk, until committed
+
+    def index(self, indexer, path):
+        """
+        yields a pair of (item, unchanged) for each item below `path`, in `os.walk` order,
+        where `unchanged` is true if the item was found in an unchanged directory
+        """
+        for (dir_items,),unchanged in self.walk([indexer], path):
+            for item in dir_items:
+                yield item, unchanged
+
+    def walk(self, indexers, path):
+        """
+        walks `path` once for several indexers sharing their walk options, which must be the same
+        on every walk, yielding a pair of (tuple of the list of items each indexer finds, unchanged)
+        for each directory, where `unchanged` is true if the directory is unchanged
+        compared to the last committed walk
+        """
+        prune = indexers[0].prune
+        maxdepth = indexers[0].maxdepth
+        self.walked = None
+        directories = {}
+        listed = 0
+        stack = [(path, 0)]
+        while stack:
+            dirpath,depth = stack.pop()
+            try:
+                mtime = os.stat(dirpath).st_mtime
+            except OSError:
+                continue
+            known = self.directories.get(dirpath)
+            if known and known[0] == mtime:
+                _,subdirectories,dir_items = known
+                unchanged = True
+            else:
+                try:
+                    subdirectories,filenames = listdir(dirpath, prune)
+                except OSError:
+                    continue
+                listed = listed + 1
+                dir_items = tuple(indexer.index_directory(dirpath, filenames) for indexer in indexers)
+                unchanged = False
+            directories[dirpath] = (mtime, subdirectories, dir_items)
+            yield dir_items, unchanged
+            if not maxdepth or depth < maxdepth:
+                stack.extend((subdirectory, depth + 1) for subdirectory in reversed(subdirectories))
+        logging.debug("walked %d directories below %s, listed %d" % (len(directories), path, listed))
+        self.walked = directories
+
+    def commit(self):
+        """remembers the state of the last completed walk, against which the next walk is compared"""
+        if self.walked is not None:
+            self.directories = self.walked
+            self.walked = None
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+import time
+import logging
+import threading
+
+try:
+    import inotify.adapters
+    import inotify.constants
+except ImportError:
+    inotify = None
+
+WATCH_MASK = 0
+if inotify:
+    WATCH_MASK = (inotify.constants.IN_CREATE | inotify.constants.IN_CLOSE_WRITE | inotify.constants.IN_DELETE
+            | inotify.constants.IN_MOVED_FROM | inotify.constants.IN_MOVED_TO)
+
+def available():
+    return inotify is not None
+
+def coalesce(paths):
+    """drops the paths which are below another of `paths`"""
+    out = []
+    for path in sorted(paths):
+        if out and (path == out[-1] or path.startswith(out[-1] + os.sep)):
+            continue
+        out.append(path)
+    return out
+
+class SourceWatcher(threading.Thread):
+    """
+    Watches the tree below `source` with inotify.
+
+    Collects the directories in which files were created, written, moved or deleted
+    (or the directory itself, for directory events) and once no further change has
+    arrived for `delay` seconds, calls `callback(source, directories)`. While changes keep
+    arriving, it is called at least every `maxdelay` seconds after the first pending change.
+    If watching fails, e.g. when the tree has more directories than inotify may watch,
+    `failed(source, exception)` is called and the thread stops.
+    """
+    def __init__(self, source, callback, delay, maxdelay, failed):
+        super(SourceWatcher, self).__init__(name="watch %s" % source)
+        self.daemon = True
+        self.source = source
+        self.callback = callback
+        self.delay = delay
+        self.maxdelay = maxdelay
+        self.failed = failed
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        logging.info("watching %s" % self.source)
+        try:
+            self._watch()
+        except Exception, e:
+            # e.g. ENOSPC once fs.inotify.max_user_watches is exceeded
+            logging.exception("failed to watch %s" % self.source)
+            self.failed(self.source, e)
+            return
+        logging.info("stopped watching %s" % self.source)
+
+    def _watch(self):
+        tree = inotify.adapters.InotifyTree(self.source, mask=WATCH_MASK)
+        pending = set()
+        first_change = 0
+        last_change = 0
+        # yields None about once a second when there are no events, which drives the debounce
+        for event in tree.event_gen(yield_nones=True):
+            if self._stopped.is_set():
+                break
+            now = time.time()
+            if event is not None:
+                _,type_names,path,filename = event
+                if filename:
+                    if not pending:
+                        first_change = now
+                    pending.add(os.path.join(path, filename) if "IN_ISDIR" in type_names else path)
+                last_change = now
+            if pending and (now - last_change >= self.delay or now - first_change >= self.maxdelay):
+                directories = coalesce(pending)
+                pending = set()
+                logging.debug("changes below %s: %s" % (self.source, directories))
+                try:
+                    self.callback(self.source, directories)
+                except Exception:
+                    logging.exception("failed to update %s after changes" % self.source)